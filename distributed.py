@@ -0,0 +1,464 @@
+"""
+Coordinator/worker mode for running many races across processes on one host.
+
+A SQLite file stands in for a message broker: it holds the task queue
+(races, or single-page frontier expansions) and a shared page store of
+scraped links. Any process on the same host can open the file and act as a
+worker. The broker uses WAL mode, whose shared-memory index only works
+between processes on one machine, so the file must not be placed on a
+network filesystem to share it between nodes. Workers fetch through one
+FetchScheduler each, sharing per-host token buckets in a directory next to
+the broker file, so adding processes does not raise the request rate. Tasks and page fetches are claimed with a
+lease that a heartbeat thread renews while the worker is alive, so two
+workers never run the same task or fetch the same page at once; the second
+one waits for the first to publish and then reuses the result. Pages are
+stored unembedded, so each worker's lexical prefilter and page workspace
+decide what to encode.
+
+Usage:
+    python distributed.py submit --db broker.sqlite START_URL TARGET_URL
+    python distributed.py expand --db broker.sqlite URL [URL ...]
+    python distributed.py worker --db broker.sqlite --processes 4 --exit-when-idle
+    python distributed.py status --db broker.sqlite
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import socket
+import sqlite3
+import threading
+import time
+from urllib.parse import urlparse
+
+from fetcher import PRIORITY_NORMAL, FetchScheduler
+from link_table import LinkTable, page_key
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    worker TEXT,
+    lease_until REAL,
+    result TEXT,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status, id);
+CREATE TABLE IF NOT EXISTS pages (
+    key TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    worker TEXT,
+    lease_until REAL,
+    data TEXT,
+    updated REAL NOT NULL
+);
+"""
+
+
+class SQLiteBroker:
+    """
+    Task queue and shared page store backed by one SQLite file.
+
+    Each thread gets its own connection, so the broker can be used from
+    prefetch threads as well as the racer's thread.
+    """
+
+    def __init__(self, path: str, lease_seconds: float = 300.0):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """The calling thread's connection, opened on first use."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # check_same_thread=False only so close() can close every thread's connection
+            conn = sqlite3.connect(self.path, timeout=60, isolation_level=None, check_same_thread=False)
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def close(self):
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections = []
+
+    def _transaction(self):
+        """Start a write transaction that holds the database lock immediately."""
+        self.conn.execute("BEGIN IMMEDIATE")
+
+    # Tasks
+
+    def submit(self, kind: str, payload: dict) -> int:
+        """Queue a task and return its ID."""
+        cursor = self.conn.execute(
+            "INSERT INTO tasks (kind, payload, created) VALUES (?, ?, ?)",
+            (kind, json.dumps(payload), time.time())
+        )
+        return cursor.lastrowid
+
+    def claim(self, worker: str) -> tuple:
+        """
+        Lease the oldest pending task (or one whose lease has expired).
+
+        Returns:
+            tuple: (task_id, kind, payload) or None if the queue is empty
+        """
+        now = time.time()
+        self._transaction()
+        try:
+            row = self.conn.execute(
+                "SELECT id, kind, payload FROM tasks "
+                "WHERE status = 'pending' OR (status = 'running' AND lease_until < ?) "
+                "ORDER BY id LIMIT 1",
+                (now,)
+            ).fetchone()
+            if row:
+                self.conn.execute(
+                    "UPDATE tasks SET status = 'running', worker = ?, lease_until = ? WHERE id = ?",
+                    (worker, now + self.lease_seconds, row[0])
+                )
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+
+        if not row:
+            return None
+        return row[0], row[1], json.loads(row[2])
+
+    def complete(self, task_id: int, worker: str, result: dict, failed: bool = False) -> bool:
+        """
+        Record a task's result if worker still holds its lease.
+
+        Returns:
+            bool: False if the lease expired and another worker took the task over
+        """
+        cursor = self.conn.execute(
+            "UPDATE tasks SET status = ?, result = ?, lease_until = NULL "
+            "WHERE id = ? AND worker = ? AND status = 'running'",
+            ('failed' if failed else 'done', json.dumps(result), task_id, worker)
+        )
+        return cursor.rowcount == 1
+
+    def renew(self, worker: str):
+        """Extend every task and page lease held by worker."""
+        until = time.time() + self.lease_seconds
+        self.conn.execute(
+            "UPDATE tasks SET lease_until = ? WHERE worker = ? AND status = 'running'", (until, worker)
+        )
+        self.conn.execute(
+            "UPDATE pages SET lease_until = ? WHERE worker = ? AND status = 'fetching'", (until, worker)
+        )
+
+    def results(self, task_ids: list = None) -> dict:
+        """Map of task ID to (status, result) for finished tasks."""
+        rows = self.conn.execute(
+            "SELECT id, status, result FROM tasks WHERE status IN ('done', 'failed')"
+        ).fetchall()
+        wanted = set(task_ids) if task_ids else None
+        return {
+            task_id: (status, json.loads(result))
+            for task_id, status, result in rows
+            if wanted is None or task_id in wanted
+        }
+
+    def counts(self) -> dict:
+        """Number of tasks in each status, plus the number of stored pages."""
+        counts = dict(self.conn.execute("SELECT status, COUNT(*) FROM tasks GROUP BY status").fetchall())
+        counts['pages'] = self.conn.execute("SELECT COUNT(*) FROM pages WHERE status = 'done'").fetchone()[0]
+        return counts
+
+    # Pages
+
+    def claim_page(self, key: str, worker: str) -> tuple:
+        """
+        Look up a page, claiming the right to fetch it if nobody has.
+
+        Returns:
+            tuple: ('done', data) with the stored page JSON, ('claimed', None) if
+            the caller should fetch and publish it, or ('busy', None) if
+            another worker is fetching it now
+        """
+        now = time.time()
+        self._transaction()
+        try:
+            row = self.conn.execute(
+                "SELECT status, lease_until, data FROM pages WHERE key = ?", (key,)
+            ).fetchone()
+
+            if row and row[0] == 'done':
+                self.conn.execute("COMMIT")
+                return 'done', row[2]
+
+            if row and row[0] == 'fetching' and row[1] > now:
+                self.conn.execute("COMMIT")
+                return 'busy', None
+
+            self.conn.execute(
+                "INSERT OR REPLACE INTO pages (key, status, worker, lease_until, updated) "
+                "VALUES (?, 'fetching', ?, ?, ?)",
+                (key, worker, now + self.lease_seconds, now)
+            )
+            self.conn.execute("COMMIT")
+            return 'claimed', None
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+
+    def publish_page(self, key: str, data: str):
+        """Store a fetched page and release its claim."""
+        self.conn.execute(
+            "UPDATE pages SET status = 'done', lease_until = NULL, data = ?, updated = ? WHERE key = ?",
+            (data, time.time(), key)
+        )
+
+    def release_page(self, key: str):
+        """Drop a claim after a failed fetch so another worker can retry."""
+        self.conn.execute("DELETE FROM pages WHERE key = ? AND status = 'fetching'", (key,))
+
+
+class SharedPageStore:
+    """
+    Link source that deduplicates fetches through the broker's page store.
+
+    Call it like scrape_wikipedia_links. Pages already published are served
+    from the store, pages another worker is fetching are waited for, and
+    anything else is fetched and published.
+    """
+
+    def __init__(self, broker: SQLiteBroker, worker: str, fetch, poll_interval: float = 0.2):
+        self.broker = broker
+        self.worker = worker
+        self.fetch = fetch
+        self.poll_interval = poll_interval
+        self.stats = {'hits': 0, 'fetches': 0, 'waits': 0}
+
+    def __call__(self, url: str, scheduler=None, priority: int = PRIORITY_NORMAL) -> dict:
+        key = page_key(urlparse(url).path)
+
+        while True:
+            status, raw = self.broker.claim_page(key, self.worker)
+
+            if status == 'done':
+                self.stats['hits'] += 1
+                return self._decode(raw)
+
+            if status == 'busy':
+                self.stats['waits'] += 1
+                time.sleep(self.poll_interval)
+                continue
+
+            try:
+                data = self.fetch(url, scheduler, priority)
+            except Exception:
+                self.broker.release_page(key)
+                raise
+
+            if not data:
+                self.broker.release_page(key)
+                return data
+
+            self.stats['fetches'] += 1
+            self._publish(key, data)
+            return data
+
+    def _publish(self, key: str, data: dict):
+        payload = {**data, 'links': data['links'].to_dict()}
+        self.broker.publish_page(key, json.dumps(payload))
+
+    def _decode(self, raw: str) -> dict:
+        data = json.loads(raw)
+        data['links'] = LinkTable.from_dict(data['links'])
+        return data
+
+
+class LeaseHeartbeat:
+    """
+    Background thread that renews a worker's leases until stopped.
+
+    It uses its own broker connection, so a race that runs longer than the
+    lease keeps its task and page claims.
+    """
+
+    def __init__(self, db_path: str, worker: str, lease_seconds: float = 300.0, interval: float = None):
+        self.db_path = db_path
+        self.worker = worker
+        self.lease_seconds = lease_seconds
+        self.interval = interval or lease_seconds / 3
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        broker = SQLiteBroker(self.db_path, self.lease_seconds)
+        try:
+            while not self._stop.wait(self.interval):
+                try:
+                    broker.renew(self.worker)
+                except sqlite3.Error as e:
+                    print(f"Lease renewal for {self.worker} failed: {e}")
+        finally:
+            broker.close()
+
+
+class Coordinator:
+    """Submits races and frontier expansions and collects their results."""
+
+    def __init__(self, db_path: str):
+        self.broker = SQLiteBroker(db_path)
+
+    def submit_race(self, start_url: str, end_url: str) -> int:
+        return self.broker.submit('race', {'start_url': start_url, 'end_url': end_url})
+
+    def submit_expand(self, url: str) -> int:
+        return self.broker.submit('expand', {'url': url})
+
+    def wait(self, task_ids: list, poll_interval: float = 1.0, timeout: float = None) -> dict:
+        """Block until every task in task_ids has finished (or timeout passes)."""
+        deadline = time.time() + timeout if timeout else None
+        while True:
+            results = self.broker.results(task_ids)
+            if len(results) == len(task_ids):
+                return results
+            if deadline and time.time() > deadline:
+                return results
+            time.sleep(poll_interval)
+
+
+def bucket_dir(db_path: str) -> str:
+    """Directory next to the broker file holding the workers' shared token buckets."""
+    return f"{db_path}.buckets"
+
+
+def run_worker(db_path: str, worker: str = None, exit_when_idle: bool = False,
+               poll_interval: float = 1.0, racer_options: dict = None):
+    """
+    Pull and execute tasks until stopped (or until the queue is empty).
+
+    Args:
+        db_path: Broker SQLite file
+        worker: Worker name (defaults to host:pid)
+        exit_when_idle: Return once no task is available
+        poll_interval: Seconds to sleep when the queue is empty
+        racer_options: Extra keyword arguments for WikiRacer
+    """
+    from main import WikiRacer
+
+    worker = worker or f"{socket.gethostname()}:{os.getpid()}"
+    broker = SQLiteBroker(db_path)
+    # Every worker on the host draws from the same per-host request budget
+    scheduler = FetchScheduler(state_dir=bucket_dir(db_path))
+    racer = WikiRacer(**{'scheduler': scheduler, **(racer_options or {})})
+    store = SharedPageStore(broker, worker, racer.link_source)
+    racer.link_source = store
+    # Batched speculation would bypass the shared store's claims
+    racer.batch_source = None
+    heartbeat = LeaseHeartbeat(db_path, worker, broker.lease_seconds).start()
+
+    print(f"Worker {worker} started")
+    try:
+        while True:
+            task = broker.claim(worker)
+            if task is None:
+                if exit_when_idle:
+                    break
+                time.sleep(poll_interval)
+                continue
+
+            task_id, kind, payload = task
+            started = time.time()
+            try:
+                if kind == 'race':
+                    success = racer.race(payload['start_url'], payload['end_url'])
+                    result = {'success': success, 'path': racer.path_history}
+                    # atexit hooks don't run in multiprocessing children, so write rows as we go
+                    if racer.run_log:
+                        racer.run_log.flush()
+                elif kind == 'expand':
+                    data = store(payload['url'], racer.scheduler)
+                    result = {'links': len(data['links']) if data else 0}
+                else:
+                    raise ValueError(f"Unknown task kind: {kind}")
+                result['worker'] = worker
+                result['seconds'] = time.time() - started
+                completed = broker.complete(task_id, worker, result)
+            except Exception as e:
+                print(f"Task {task_id} failed: {e}")
+                completed = broker.complete(task_id, worker, {'error': str(e), 'worker': worker}, failed=True)
+            if not completed:
+                print(f"Task {task_id} lease was lost; its result was discarded")
+    finally:
+        print(f"Worker {worker} stopping (page store: {store.stats})")
+        racer.close()
+        heartbeat.stop()
+        scheduler.shutdown()
+        broker.close()
+
+
+def run_workers(db_path: str, processes: int, exit_when_idle: bool = False):
+    """Run several worker processes on this node and wait for them."""
+    procs = [
+        multiprocessing.Process(target=run_worker, args=(db_path,), kwargs={'exit_when_idle': exit_when_idle})
+        for _ in range(processes)
+    ]
+    for proc in procs:
+        proc.start()
+    for proc in procs:
+        proc.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Distributed WikiRacer coordinator/worker")
+    parser.add_argument('--db', default='wikiracer_broker.sqlite', help="Broker SQLite file")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    submit = commands.add_parser('submit', help="Queue a race")
+    submit.add_argument('start_url')
+    submit.add_argument('end_url')
+
+    expand = commands.add_parser('expand', help="Queue page expansions into the shared store")
+    expand.add_argument('urls', nargs='+')
+
+    worker = commands.add_parser('worker', help="Run worker processes")
+    worker.add_argument('--processes', type=int, default=1)
+    worker.add_argument('--exit-when-idle', action='store_true')
+
+    commands.add_parser('status', help="Show queue and store counts")
+
+    args = parser.parse_args()
+
+    if args.command == 'worker':
+        run_workers(args.db, args.processes, args.exit_when_idle)
+        return
+
+    coordinator = Coordinator(args.db)
+    if args.command == 'submit':
+        print(f"Queued race {coordinator.submit_race(args.start_url, args.end_url)}")
+    elif args.command == 'expand':
+        for url in args.urls:
+            print(f"Queued expansion {coordinator.submit_expand(url)}: {url}")
+    elif args.command == 'status':
+        print(coordinator.broker.counts())
+        for task_id, (status, result) in sorted(coordinator.broker.results().items()):
+            print(f"  {task_id}: {status} {result}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,194 @@
 import os
+import sys
+from collections import OrderedDict
+
 import chromadb
+import numpy as np
 from sentence_transformers import SentenceTransformer
 
+from link_table import LinkTable
+from quantized import STORAGE_DTYPES, EmbeddingCache, MemoryBudget, QuantizedMatrix
+
+# Default cap on cached embedding bytes per process
+DEFAULT_MEMORY_BUDGET = 256 * 1024 * 1024
+
+
+class TargetProfile:
+    """
+    Per-race embedding of the target page.
+
+    Holds the target title vector plus optional context vectors (e.g. link
+    names from the target's lead section). Everything is unit-normalized, so
+    scoring a page's links is one matrix product followed by a max or mean
+    over the target vectors.
+    """
+
+    def __init__(self, title: str, vectors: np.ndarray, weights: np.ndarray, reduce: str = 'max'):
+        if reduce not in ('max', 'mean'):
+            raise ValueError(f"Unknown reduce mode: {reduce}")
+
+        self.title = title
+        self.vectors = vectors
+        self.weights = weights
+        self.reduce = reduce
+
+    def similarity(self, embeddings: QuantizedMatrix) -> np.ndarray:
+        """
+        Cosine similarity of each row of embeddings to the target.
+
+        Args:
+            embeddings: Unit-normalized QuantizedMatrix of n_links rows
+
+        Returns:
+            Array of n_links similarities
+        """
+        scores = embeddings.scores(self.vectors) * self.weights
+        if self.reduce == 'max':
+            return scores.max(axis=1)
+        return scores.sum(axis=1) / self.weights.sum()
+
+
+class PageWorkspace:
+    """
+    Embedded link matrices of recently seen pages.
+
+    Entries are keyed by canonical page and remember the revision they were
+    built from. Revisiting the same revision reuses the matrix outright; a
+    new revision drops the links that disappeared and embeds only the ones
+    that were added. Entries are evicted least recently used first when the
+    shared MemoryBudget is exceeded.
+    """
+
+    def __init__(self, budget: MemoryBudget):
+        self.pages = OrderedDict()
+        self.bytes = 0
+        self.stats = {'hits': 0, 'partial': 0, 'misses': 0, 'invalidations': 0, 'reused_rows': 0, 'encoded_rows': 0}
+        budget.register(self)
+
+    def nbytes(self) -> int:
+        return self.bytes
+
+    def shrink(self, nbytes: int) -> int:
+        """Evict least recently used pages until nbytes are freed (or none are left)."""
+        freed = 0
+        while self.pages and freed < nbytes:
+            _, entry = self.pages.popitem(last=False)
+            self.bytes -= entry['nbytes']
+            freed += entry['nbytes']
+        return freed
+
+    def report(self) -> dict:
+        rows = sum(len(entry['names']) for entry in self.pages.values())
+        lookups = self.stats['hits'] + self.stats['partial'] + self.stats['misses']
+        return {
+            'name': 'page workspace',
+            'dtype': next(iter(self.pages.values()))['embeddings'].dtype if self.pages else '',
+            'pages': len(self.pages),
+            'entries': rows,
+            'bytes': self.bytes,
+            'bytes_per_link': self.bytes / rows if rows else 0.0,
+            'hit_rate': self.stats['hits'] / lookups if lookups else 0.0,
+            **self.stats,
+        }
+
+    def embed(self, key: str, revision: int, page_links: LinkTable, links: LinkTable, encode) -> QuantizedMatrix:
+        """
+        Embeddings for links (a subset of page_links), reusing cached rows.
+
+        Args:
+            key: Canonical page key
+            revision: Page revision ID (None if unknown; never matches)
+            page_links: Every link on the page, used to drop removed links
+            links: Links to embed
+            encode: Callable(list of names) -> QuantizedMatrix for new names
+
+        Returns:
+            QuantizedMatrix with one row per link
+        """
+        entry = self.pages.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry['nbytes']
+            if revision is None or entry['revision'] != revision:
+                self.stats['invalidations'] += 1
+                entry = self._drop_removed(entry, page_links)
+
+        if entry is not None and entry['names_list'] == links.names:
+            self.stats['hits'] += 1
+            self.stats['reused_rows'] += len(links)
+            rows = entry['rows']
+            embeddings = entry['embeddings'] if rows is None else entry['embeddings'][rows]
+        else:
+            rows = np.array([entry['names'].get(name, -1) for name in links.names] if entry else
+                            [-1] * len(links), dtype=np.int64)
+            missing = np.flatnonzero(rows < 0)
+            missing_names = list(dict.fromkeys(links.names[i] for i in missing))
+
+            if entry is None:
+                entry = {'names': {}, 'embeddings': None}
+                self.stats['misses'] += 1
+            elif len(missing):
+                self.stats['partial'] += 1
+            else:
+                self.stats['hits'] += 1
+
+            if missing_names:
+                encoded = encode(missing_names)
+                base = len(entry['names'])
+                for offset, name in enumerate(missing_names):
+                    entry['names'][name] = base + offset
+                entry['embeddings'] = encoded if entry['embeddings'] is None else entry['embeddings'].append(encoded)
+                rows[missing] = [entry['names'][links.names[i]] for i in missing]
+
+            self.stats['reused_rows'] += len(links) - len(missing)
+            self.stats['encoded_rows'] += len(missing_names)
+            embeddings = entry['embeddings'][rows]
+            entry['names_list'] = list(links.names)
+            # Matrix rows for names_list, or None when they are the stored matrix as is
+            identity = len(rows) == len(entry['embeddings']) and np.array_equal(rows, np.arange(len(rows)))
+            entry['rows'] = None if identity else rows
+
+        entry['revision'] = revision
+        entry['nbytes'] = entry['embeddings'].nbytes + sum(sys.getsizeof(name) for name in entry['names'])
+        self.pages[key] = entry
+        self.bytes += entry['nbytes']
+        return embeddings
+
+    def _drop_removed(self, entry: dict, page_links: LinkTable) -> dict:
+        """Keep only rows whose names still appear on the page."""
+        present = set(page_links.names)
+        kept = [(name, row) for name, row in entry['names'].items() if name in present]
+        if not kept:
+            return None
+
+        rows = np.array([row for _, row in kept], dtype=np.int64)
+        return {
+            'names': {name: i for i, (name, _) in enumerate(kept)},
+            'names_list': None,
+            'rows': None,
+            'embeddings': entry['embeddings'][rows],
+        }
+
 
 class EmbeddingStore:
-    def __init__(self, db_path: str = None):
+    def __init__(self, db_path: str = None, embedding_dtype: str = 'float32',
+                 memory_budget: int = DEFAULT_MEMORY_BUDGET):
         if db_path is None:
             script_dir = os.path.dirname(os.path.abspath(__file__))
             db_path = os.path.join(script_dir, "chroma_db")
 
+        if embedding_dtype not in STORAGE_DTYPES:
+            raise ValueError(f"Unknown embedding dtype: {embedding_dtype} (expected one of {', '.join(STORAGE_DTYPES)})")
+
         self.db_path = db_path
         self.model = None
         self.client = None
 
+        # Embeddings are kept as float32, float16 or per-row scaled int8
+        self.embedding_dtype = embedding_dtype
+        self.budget = MemoryBudget(memory_budget)
+        self.name_cache = None
+        self.workspace = PageWorkspace(self.budget)
+
     def _load_model(self):
         """Lazy load the sentence transformer model."""
         if self.model is None:
@@ -26,6 +202,43 @@ class EmbeddingStore:
             self.client = chromadb.PersistentClient(path=self.db_path)
         return self.client
 
+    def _encode(self, texts: list) -> QuantizedMatrix:
+        """
+        Embed texts, reusing cached vectors for texts seen before.
+
+        Only cache misses go through the model; the result is quantized to
+        embedding_dtype and the new vectors are added to the cache.
+        """
+        model = self._load_model()
+        dim = model.get_sentence_embedding_dimension()
+        if self.name_cache is None:
+            self.name_cache = EmbeddingCache('link names', dim, self.embedding_dtype, self.budget)
+
+        slots = self.name_cache.lookup(texts)
+        hit = slots >= 0
+        embeddings = QuantizedMatrix.empty(len(texts), dim, self.embedding_dtype)
+        embeddings.assign(np.flatnonzero(hit), self.name_cache.gather(slots[hit]))
+
+        miss_rows = np.flatnonzero(~hit)
+        if len(miss_rows):
+            miss_texts = [texts[i] for i in miss_rows]
+            encoded = self._encode_uncached(miss_texts)
+            embeddings.assign(miss_rows, encoded)
+            self.name_cache.put(miss_texts, encoded)
+
+        return embeddings
+
+    def _encode_uncached(self, texts: list) -> QuantizedMatrix:
+        """Run the model on texts and quantize the result to embedding_dtype."""
+        return QuantizedMatrix.from_float(
+            self._load_model().encode(texts, show_progress_bar=False, normalize_embeddings=True),
+            self.embedding_dtype
+        )
+
+    def memory_report(self) -> dict:
+        """Bytes used by the embedding caches, per cache and per cached link."""
+        return self.budget.report()
+
     def _clear_collection(self):
         """Clear the ChromaDB collection."""
         client = self._get_client()
@@ -34,23 +247,29 @@ class EmbeddingStore:
         except ValueError:
             pass
 
-    def store_links(self, links: list) -> chromadb.Collection:
+    def store_links(self, links: LinkTable, index: bool = True) -> chromadb.Collection:
         """
         Create embeddings for links and store in ChromaDB.
 
+        The unit-normalized embedding matrix is also kept on links.embeddings
+        (as a QuantizedMatrix), and the collection IDs are row numbers into
+        the table.
+
         Args:
-            links: List of dicts with 'name' and 'url' keys
+            links: LinkTable of links to embed
+            index: Whether to also build the ChromaDB collection
 
         Returns:
-            ChromaDB collection
+            ChromaDB collection, or None if index is False
         """
-        self._clear_collection()
+        print("Creating embeddings...")
+        embeddings = self._encode(links.names)
+        links.embeddings = embeddings
 
-        model = self._load_model()
-        link_names = [link['name'] for link in links]
+        if not index:
+            return None
 
-        print("Creating embeddings...")
-        embeddings = model.encode(link_names, show_progress_bar=False)
+        self._clear_collection()
 
         client = self._get_client()
         collection = client.create_collection(
@@ -60,57 +279,86 @@ class EmbeddingStore:
 
         collection.add(
             ids=[str(i) for i in range(len(links))],
-            embeddings=embeddings.tolist(),
-            metadatas=[{"name": link['name'], "url": link['url']} for link in links],
-            documents=link_names
+            embeddings=embeddings.to_float().tolist()
         )
 
         return collection
 
-    def find_closest(self, query: str, collection, n_results: int = 1, exclude_urls: set = None) -> list:
+    def embed_page(self, key: str, revision: int, page_links: LinkTable, links: LinkTable = None):
         """
-        Find links most semantically similar to the query.
+        Embed a page's links through the page workspace.
+
+        Unlike store_links, nothing is discarded between pages: a page seen
+        before at the same revision costs no encoding, and a newer revision
+        only encodes its added links. New names are encoded straight into
+        the workspace rather than through the name cache, so each vector is
+        stored once.
 
         Args:
-            query: Search query string
-            collection: ChromaDB collection to search
-            n_results: Number of results to return
-            exclude_urls: Set of URLs to exclude from results
+            key: Canonical page key
+            revision: Page revision ID, or None if unknown
+            page_links: Every link on the page
+            links: Subset of page_links to embed (defaults to all of them)
+        """
+        links = page_links if links is None else links
+        encoded = self.workspace.stats['encoded_rows']
+        links.embeddings = self.workspace.embed(key, revision, page_links, links, self._encode_uncached)
+        self.budget.enforce()
+        print(f"Embedded {len(links)} links ({self.workspace.stats['encoded_rows'] - encoded} newly encoded)")
+
+    def build_target_profile(self, title: str, context: list = None, context_weight: float = 0.5,
+                             reduce: str = 'max') -> TargetProfile:
+        """
+        Embed the target once for the whole race.
+
+        Args:
+            title: Target page title
+            context: Optional extra texts describing the target
+            context_weight: Weight of each context vector relative to the title
+            reduce: How to combine per-vector similarities ('max' or 'mean')
 
         Returns:
-            List of dicts with 'name', 'url', and 'distance' keys
+            TargetProfile
         """
         model = self._load_model()
-        query_embedding = model.encode([query])[0]
+        texts = [title] + list(context or [])
+        vectors = model.encode(texts, show_progress_bar=False, normalize_embeddings=True)
 
-        # Request more results if we need to filter some out
-        fetch_count = n_results
-        if exclude_urls:
-            fetch_count = min(n_results + len(exclude_urls), 100)
+        weights = np.full(len(texts), context_weight, dtype=np.float32)
+        weights[0] = 1.0
+        return TargetProfile(title, np.asarray(vectors, dtype=np.float32), weights, reduce)
 
-        results = collection.query(
-            query_embeddings=[query_embedding.tolist()],
-            n_results=fetch_count
-        )
+    def rank_links(self, profile: TargetProfile, links: LinkTable, n_results: int = 1,
+                   exclude_ids: set = None) -> list:
+        """
+        Find the links closest to a target profile using links.embeddings.
 
-        if not results['metadatas'] or not results['metadatas'][0]:
-            return []
+        Args:
+            profile: TargetProfile for the race
+            links: LinkTable already embedded by store_links
+            n_results: Number of results to return
+            exclude_ids: Set of page IDs to exclude from results
 
-        matches = []
-        for i, metadata in enumerate(results['metadatas'][0]):
-            url = metadata['url']
+        Returns:
+            List of link dicts (see LinkTable) with an added 'distance' key
+        """
+        if not len(links):
+            return []
 
-            # Skip excluded URLs
-            if exclude_urls and url in exclude_urls:
-                continue
+        scores = profile.similarity(links.embeddings)
+        if exclude_ids:
+            scores[links.mask_ids(exclude_ids)] = -np.inf
 
-            matches.append({
-                'name': metadata['name'],
-                'url': url,
-                'distance': results['distances'][0][i] if results['distances'] else None
-            })
+        count = min(n_results, len(links))
+        top = np.argpartition(-scores, count - 1)[:count]
+        top = top[np.argsort(-scores[top])]
 
-            if len(matches) >= n_results:
+        matches = []
+        for row in top:
+            if scores[row] == -np.inf:
                 break
+            match = links[row]
+            match['distance'] = float(1.0 - scores[row])
+            matches.append(match)
 
         return matches
@@ -0,0 +1,333 @@
+import heapq
+import itertools
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import Future
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+import requests
+
+try:
+    import fcntl
+except ImportError:  # Windows: buckets are shared across threads only
+    fcntl = None
+
+# Priority lanes (lower runs first)
+PRIORITY_TARGET = 0
+PRIORITY_NORMAL = 1
+PRIORITY_PREFETCH = 2
+
+LANE_NAMES = {PRIORITY_TARGET: 'target', PRIORITY_NORMAL: 'normal', PRIORITY_PREFETCH: 'prefetch'}
+
+THROTTLE_STATUSES = (429, 503)
+
+DEFAULT_HEADERS = {
+    'User-Agent': 'WikiRacer/1.0 (Educational Project)'
+}
+
+
+def parse_retry_after(value: str) -> float:
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP date), or None."""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """
+    Token-bucket rate limiter keyed by host.
+
+    Buckets are shared by all threads in the process. When state_dir is set,
+    each host's bucket lives in a small lock-protected file there, so every
+    process pointing at the same directory draws from the same budget.
+    """
+
+    def __init__(self, rate: float = 5.0, capacity: float = 10.0, state_dir: str = None):
+        self.rate = rate
+        self.capacity = capacity
+        self.state_dir = state_dir if fcntl else None
+        self._lock = threading.Lock()
+        self._buckets = {}
+
+        if self.state_dir:
+            os.makedirs(self.state_dir, exist_ok=True)
+
+    def try_acquire(self, host: str) -> float:
+        """Take a token for host if one is available; otherwise return seconds to wait."""
+        return self._update(host, take=True)
+
+    def block(self, host: str, delay: float):
+        """Stop all requests to host for delay seconds (e.g. after a 429)."""
+        self._update(host, block_until=time.time() + delay)
+
+    def _update(self, host: str, take: bool = False, block_until: float = None) -> float:
+        """Refill, optionally take a token or extend a block; return seconds to wait."""
+        with self._lock:
+            if self.state_dir:
+                path = os.path.join(self.state_dir, f"{host}.bucket")
+                with open(path, 'a+') as f:
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                    f.seek(0)
+                    raw = f.read()
+                    state = json.loads(raw) if raw else None
+                    wait, state = self._step(state, take, block_until)
+                    f.seek(0)
+                    f.truncate()
+                    f.write(json.dumps(state))
+                    return wait
+
+            wait, self._buckets[host] = self._step(self._buckets.get(host), take, block_until)
+            return wait
+
+    def _step(self, state: dict, take: bool, block_until: float) -> tuple:
+        now = time.time()
+        if state is None:
+            state = {'tokens': self.capacity, 'updated': now, 'blocked_until': 0.0}
+
+        elapsed = max(now - state['updated'], 0.0)
+        state['tokens'] = min(self.capacity, state['tokens'] + elapsed * self.rate)
+        state['updated'] = now
+
+        if block_until is not None:
+            state['blocked_until'] = max(state['blocked_until'], block_until)
+            # Drain the bucket so the host is not hit with a burst afterwards
+            state['tokens'] = 0.0
+
+        if not take:
+            return 0.0, state
+
+        if state['blocked_until'] > now:
+            return state['blocked_until'] - now, state
+        if state['tokens'] >= 1.0:
+            state['tokens'] -= 1.0
+            return 0.0, state
+        return (1.0 - state['tokens']) / self.rate, state
+
+
+class FetchScheduler:
+    """
+    Rate-limited HTTP fetcher with priority lanes and retries.
+
+    Requests are queued by priority (target checks before normal page loads
+    before speculative prefetches) and served by a small pool of worker
+    threads. A request only leaves the queue once its host's token bucket
+    admits it, so while a host is rate limited the highest-priority waiting
+    request always gets the next token. 429/503 responses and connection
+    errors put the request back in its lane with exponential backoff and
+    jitter, honouring Retry-After (capped at backoff_max) when the server
+    sends it. Queue wait metrics cover the whole time a request spent
+    waiting, including backoff and rate-limit blocks.
+    """
+
+    def __init__(self, rate: float = 5.0, burst: float = 10.0, workers: int = 4,
+                 max_retries: int = 4, backoff_base: float = 0.5, backoff_max: float = 30.0,
+                 timeout: float = 30.0, state_dir: str = None, headers: dict = None):
+        self.bucket = TokenBucket(rate, burst, state_dir)
+        self.workers = workers
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.headers = headers or DEFAULT_HEADERS
+
+        self._queue = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._threads = []
+        self._closed = False
+
+        self.queue_waits = {lane: [] for lane in LANE_NAMES}
+        self.stats = {'requests': 0, 'retries': 0, 'throttled': 0, 'failures': 0}
+
+    def submit(self, url: str, priority: int = PRIORITY_NORMAL) -> Future:
+        """
+        Queue a GET request.
+
+        Args:
+            url: URL to fetch
+            priority: One of the PRIORITY_* lanes
+
+        Returns:
+            Future resolving to the requests.Response
+        """
+        future = Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("FetchScheduler has been shut down")
+            now = time.time()
+            # (priority, seq, url, future, attempt, not_before, queued_at, waited)
+            heapq.heappush(self._queue, (priority, next(self._counter), url, future, 0, now, now, 0.0))
+            self._start_workers()
+            self._cond.notify()
+        return future
+
+    def fetch(self, url: str, priority: int = PRIORITY_NORMAL) -> requests.Response:
+        """Fetch a URL and wait for the response (raises RequestException on failure)."""
+        return self.submit(url, priority).result()
+
+    def shutdown(self):
+        """Stop the worker threads once the queue drains."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join()
+
+    def metrics(self) -> dict:
+        """Queue wait statistics per lane plus request counters."""
+        lanes = {}
+        for lane, waits in self.queue_waits.items():
+            ordered = sorted(waits)
+            lanes[LANE_NAMES[lane]] = {
+                'count': len(ordered),
+                'mean_wait': sum(ordered) / len(ordered) if ordered else 0.0,
+                'p95_wait': ordered[int(0.95 * (len(ordered) - 1))] if ordered else 0.0,
+                'max_wait': ordered[-1] if ordered else 0.0,
+            }
+        return {'lanes': lanes, **self.stats}
+
+    def _start_workers(self):
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._worker, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                entry = self._next_admitted()
+            if entry is None:
+                return
+
+            priority, seq, url, future, attempt, _, _, waited = entry
+            try:
+                response, delay = self._attempt(url, attempt)
+            except Exception as e:
+                self._finish(priority, waited, 'failures')
+                future.set_exception(e)
+                continue
+
+            if delay is None:
+                self._finish(priority, waited)
+                future.set_result(response)
+                continue
+
+            # Back into the same lane, keeping its place ahead of later requests
+            self._count('retries')
+            with self._cond:
+                now = time.time()
+                heapq.heappush(self._queue, (priority, seq, url, future, attempt + 1, now + delay, now, waited))
+                self._cond.notify()
+
+    def _next_admitted(self) -> tuple:
+        """
+        Pop the highest-priority request that may run now (caller holds _cond).
+
+        Each host's token bucket is asked once per pass, on behalf of the
+        best-placed ready request for that host, so lower lanes never take a
+        token a higher lane is waiting for.
+
+        Returns:
+            Queue entry with its accumulated wait, or None once shut down and drained
+        """
+        while True:
+            if not self._queue:
+                if self._closed:
+                    return None
+                self._cond.wait()
+                continue
+
+            now = time.time()
+            waits = []
+            asked = set()
+            for entry in sorted(self._queue):
+                priority, seq, url, future, attempt, not_before, queued_at, waited = entry
+
+                if attempt == 0 and future.cancelled():
+                    self._queue.remove(entry)
+                    heapq.heapify(self._queue)
+                    break
+                if not_before > now:
+                    waits.append(not_before - now)
+                    continue
+
+                host = urlparse(url).netloc
+                if host in asked:
+                    continue
+                asked.add(host)
+
+                wait = self.bucket.try_acquire(host)
+                if wait > 0:
+                    waits.append(wait)
+                    continue
+
+                self._queue.remove(entry)
+                heapq.heapify(self._queue)
+                if attempt == 0 and not future.set_running_or_notify_cancel():
+                    break
+                return (priority, seq, url, future, attempt, not_before, queued_at,
+                        waited + now - queued_at)
+            else:
+                self._cond.wait(min(waits) if waits else None)
+
+    def _finish(self, priority: int, waited: float, counter: str = None):
+        with self._cond:
+            self.queue_waits[priority].append(waited)
+            if counter:
+                self.stats[counter] += 1
+
+    def _count(self, key: str):
+        with self._cond:
+            self.stats[key] += 1
+
+    def _backoff(self, attempt: int) -> float:
+        """Full-jitter exponential backoff."""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def _attempt(self, url: str, attempt: int) -> tuple:
+        """
+        Make one request after the bucket admitted it.
+
+        Returns:
+            (response, None) on success, or (None, delay) to retry after delay seconds
+
+        Raises:
+            RequestException: When the request fails and no retries are left
+        """
+        self._count('requests')
+
+        try:
+            response = requests.get(url, headers=self.headers, timeout=self.timeout)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            if attempt >= self.max_retries:
+                raise
+            return None, self._backoff(attempt)
+
+        if response.status_code in THROTTLE_STATUSES:
+            self._count('throttled')
+            if attempt >= self.max_retries:
+                response.raise_for_status()
+            retry_after = parse_retry_after(response.headers.get('Retry-After'))
+            if retry_after is None:
+                retry_after = self._backoff(attempt)
+            # The bucket holds every request for this host until the delay passes
+            self.bucket.block(urlparse(url).netloc, min(retry_after, self.backoff_max))
+            return None, 0.0
+
+        if response.status_code >= 500:
+            if attempt >= self.max_retries:
+                response.raise_for_status()
+            return None, self._backoff(attempt)
+
+        response.raise_for_status()
+        return response, None
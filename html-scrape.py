@@ -1,24 +1,45 @@
+import json
+import re
+from concurrent.futures import CancelledError
+
 import requests
 from bs4 import BeautifulSoup
 from urllib.parse import urljoin
 
+from fetcher import DEFAULT_HEADERS, PRIORITY_NORMAL
+from link_table import LinkTable, page_id, page_key, title_from_path
+
+# Containers whose links are boilerplate rather than article prose
+BOILERPLATE_CLASSES = ['navbox', 'vertical-navbox', 'sidebar', 'reflist', 'references', 'hatnote', 'metadata']
+
+# Page metadata MediaWiki embeds in its mw.config script block
+REVISION_PATTERN = re.compile(rb'"wgRevisionId":(\d+)')
+PAGE_NAME_PATTERN = re.compile(rb'"wgPageName":("(?:[^"\\]|\\.)*")')
+
 
-def scrape_wikipedia_links(url):
+def scrape_wikipedia_links(url, scheduler=None, priority=PRIORITY_NORMAL):
     """
     Scrapes a Wikipedia page and extracts all links.
 
     Args:
         url (str): The Wikipedia page URL to scrape
+        scheduler (FetchScheduler): Optional rate-limited fetcher to use
+            instead of a direct request
+        priority (int): Scheduler lane for this request
 
     Returns:
-        dict: A dictionary containing the page title and list of links
+        dict: A dictionary containing the page title and a LinkTable of
+            links. Each link carries its 'position' in the article and the
+            'section' heading it appears under ('navbox' / 'references'
+            style containers are reported as 'boilerplate'). The page's
+            'revision_id' and 'canonical_title' are included when present.
     """
     try:
-        headers = {
-            'User-Agent': 'WikiRacer/1.0 (Educational Project)'
-        }
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
+        if scheduler:
+            response = scheduler.fetch(url, priority)
+        else:
+            response = requests.get(url, headers=DEFAULT_HEADERS)
+            response.raise_for_status()
 
         soup = BeautifulSoup(response.content, 'html.parser')
 
@@ -31,30 +52,60 @@ def scrape_wikipedia_links(url):
             print("Could not find main content area")
             return None
 
-        links = []
-        seen_urls = set()
+        # Anchors inside navboxes, reference lists, etc.
+        boilerplate = set()
+        for box in content.find_all(class_=BOILERPLATE_CLASSES):
+            boilerplate.update(id(a) for a in box.find_all('a', href=True))
+
+        links = LinkTable()
+        seen_ids = set()
+        section = "Lead"
 
-        for link in content.find_all('a', href=True):
-            href = link['href']
+        # Headings and anchors come back in document order
+        for element in content.find_all(['h2', 'a']):
+            if element.name == 'h2':
+                section = element.get_text(strip=True)
+                continue
+
+            href = element.get('href')
+            if not href:
+                continue
 
             if href.startswith('/wiki/') and ':' not in href:
-                full_url = urljoin('https://en.wikipedia.org', href)
-                link_text = link.get_text(strip=True)
+                key = page_key(href)
+                pid = page_id(key)
+                link_text = element.get_text(strip=True)
+
+                if pid not in seen_ids and link_text:
+                    seen_ids.add(pid)
+                    links.append(
+                        link_text,
+                        urljoin('https://en.wikipedia.org', href),
+                        key,
+                        pid,
+                        title_from_path(href),
+                        position=len(links),
+                        section='boilerplate' if id(element) in boilerplate else section
+                    )
 
-                if full_url not in seen_urls and link_text:
-                    seen_urls.add(full_url)
-                    links.append({
-                        'name': link_text,
-                        'url': full_url
-                    })
+        revision = REVISION_PATTERN.search(response.content)
+        page_name = PAGE_NAME_PATTERN.search(response.content)
 
-        return {
+        data = {
             'source_page': title,
             'source_url': url,
             'total_links': len(links),
-            'links': links
+            'links': links,
+            'bytes': len(response.content),
+            'revision_id': int(revision.group(1)) if revision else None
         }
+        if page_name:
+            data['canonical_title'] = json.loads(page_name.group(1)).replace('_', ' ')
+        return data
 
+    except CancelledError:
+        # A speculative fetch the prefetcher gave up on
+        raise
     except requests.exceptions.RequestException as e:
         print(f"Error fetching the page: {e}")
         return None
@@ -0,0 +1,138 @@
+import re
+import numpy as np
+
+from link_table import LinkTable
+
+# Sections whose links rarely move a race forward
+REFERENCE_SECTIONS = {'references', 'notes', 'citations', 'sources', 'bibliography',
+                      'further reading', 'external links', 'see also', 'footnotes'}
+
+DATE_PATTERN = re.compile(
+    r'^(\d{1,4}s?( (AD|BC|BCE|CE))?'
+    r'|\d{1,2}(st|th|nd|rd)? century( (AD|BC|BCE|CE))?'
+    r'|(January|February|March|April|May|June|July|August|September|October|November|December)( \d{1,2})?(, \d{4})?'
+    r'|\d{1,2} (January|February|March|April|May|June|July|August|September|October|November|December)( \d{4})?)$',
+    re.IGNORECASE
+)
+TOKEN_PATTERN = re.compile(r'\w+')
+
+BOILERPLATE_PENALTY = 0.5
+REFERENCE_PENALTY = 0.3
+DATE_PENALTY = 0.4
+POSITION_WEIGHT = 0.1
+
+
+def _ngrams(text: str, n: int) -> set:
+    """Character n-grams of a padded, lowercased string."""
+    text = f" {text.lower()} "
+    return {text[i:i + n] for i in range(max(len(text) - n + 1, 1))}
+
+
+def _tokens(text: str) -> set:
+    return set(TOKEN_PATTERN.findall(text.lower()))
+
+
+class LexicalPrefilter:
+    """
+    Cheap first-stage ranker that picks the links worth embedding.
+
+    Scores every link by character n-gram and token overlap with the target
+    title, then applies penalties for navbox, reference and date links and a
+    small bonus for links early in the article.
+    """
+
+    def __init__(self, top_n: int = 200, ngram: int = 3, recall_k: int = 1):
+        self.top_n = top_n
+        self.ngram = ngram
+        self.recall_k = recall_k
+        self.recalls = []
+
+    def score(self, links: LinkTable, target_name: str) -> np.ndarray:
+        """
+        Score links against the target title.
+
+        Args:
+            links: LinkTable, using its names, positions and sections
+            target_name: Title of the target page
+
+        Returns:
+            Array of scores, one per link (higher is better)
+        """
+        count = len(links)
+        if count == 0:
+            return np.zeros(0, dtype=np.float32)
+
+        target_grams = _ngrams(target_name, self.ngram)
+        target_tokens = _tokens(target_name)
+
+        gram_overlap = np.zeros(count, dtype=np.float32)
+        gram_size = np.ones(count, dtype=np.float32)
+        token_overlap = np.zeros(count, dtype=np.float32)
+        penalty = np.zeros(count, dtype=np.float32)
+        position = np.asarray(links.positions, dtype=np.float32)
+        # Links without a known position (-1) get no position bonus
+        position[position < 0] = position.max(initial=0.0)
+
+        for i, (name, section) in enumerate(zip(links.names, links.sections)):
+            grams = _ngrams(name, self.ngram)
+            gram_overlap[i] = len(grams & target_grams)
+            gram_size[i] = len(grams)
+            token_overlap[i] = len(_tokens(name) & target_tokens)
+
+            if section == 'boilerplate':
+                penalty[i] += BOILERPLATE_PENALTY
+            elif section and section.lower() in REFERENCE_SECTIONS:
+                penalty[i] += REFERENCE_PENALTY
+            if DATE_PATTERN.match(name):
+                penalty[i] += DATE_PENALTY
+
+        # Set cosine between n-gram sets, plus a token-level Jaccard
+        gram_score = gram_overlap / np.sqrt(gram_size * max(len(target_grams), 1))
+        token_score = token_overlap / max(len(target_tokens), 1)
+        position_score = POSITION_WEIGHT * (1.0 - position / max(position.max(), 1.0))
+
+        return gram_score + token_score + position_score - penalty
+
+    def select(self, links: LinkTable, target_name: str) -> LinkTable:
+        """
+        Keep the top_n links by lexical score, in their original order.
+
+        Args:
+            links: LinkTable of candidate links
+            target_name: Title of the target page
+
+        Returns:
+            LinkTable of at most top_n links
+        """
+        if len(links) <= self.top_n:
+            return links
+
+        scores = self.score(links, target_name)
+        keep = np.argpartition(-scores, self.top_n - 1)[:self.top_n]
+        keep.sort()
+        return links.take(keep)
+
+    def record_recall(self, selected: LinkTable, full_matches: list) -> float:
+        """
+        Measure how many of the full ranking's top links survived stage 1.
+
+        Args:
+            selected: Links kept by select()
+            full_matches: Matches from ranking every link with embeddings
+
+        Returns:
+            Fraction of the top recall_k full matches present in selected
+        """
+        expected = [match['id'] for match in full_matches[:self.recall_k]]
+        if not expected:
+            return 1.0
+
+        recall = sum(pid in selected for pid in expected) / len(expected)
+        self.recalls.append(recall)
+        return recall
+
+    def mean_recall(self) -> float:
+        """Average recall over all measured pages."""
+        if not self.recalls:
+            return None
+        return sum(self.recalls) / len(self.recalls)
@@ -0,0 +1,175 @@
+import sys
+import threading
+from urllib.parse import unquote, urlparse
+
+import numpy as np
+
+# Interning of canonical page keys to integer page IDs. IDs are only
+# meaningful within one race: the racer calls reset_page_ids() at the start
+# of each race so long-lived processes don't keep every key ever seen.
+_page_ids = {}
+_page_keys = []
+_page_ids_lock = threading.Lock()
+
+
+def page_key(path: str) -> str:
+    """Canonical comparison key for a /wiki/ path (unescaped, lowercased, no fragment or query)."""
+    path = path.split('#', 1)[0].split('?', 1)[0]
+    return sys.intern(unquote(path).replace(' ', '_').lower())
+
+
+def page_id(key: str) -> int:
+    """Return the integer ID for a canonical page key, assigning one if new."""
+    pid = _page_ids.get(key)
+    if pid is None:
+        # Prefetch threads intern keys concurrently with the racer
+        with _page_ids_lock:
+            pid = _page_ids.get(key)
+            if pid is None:
+                pid = len(_page_keys)
+                _page_ids[key] = pid
+                _page_keys.append(key)
+    return pid
+
+
+def reset_page_ids():
+    """Forget every interned key; IDs handed out earlier become meaningless."""
+    global _page_ids, _page_keys
+    with _page_ids_lock:
+        _page_ids = {}
+        _page_keys = []
+
+
+def page_id_for_url(url: str) -> int:
+    """Return the integer page ID for a full Wikipedia URL."""
+    return page_id(page_key(urlparse(url).path))
+
+
+def title_from_path(path: str) -> str:
+    """Human-readable article title from a /wiki/ path."""
+    title = path.split('#', 1)[0].split('/wiki/', 1)[-1]
+    return sys.intern(unquote(title).replace('_', ' '))
+
+
+class LinkTable:
+    """
+    Column-oriented set of links from one page.
+
+    Names, URLs, canonical titles and keys, page IDs, positions and sections are kept
+    as parallel lists, and the embedding matrix (once computed) is stored
+    alongside them, so the scraper, embedding store and search share one
+    object instead of rebuilding per-link dicts at every stage.
+    """
+
+    __slots__ = ('names', 'urls', 'titles', 'keys', 'ids', 'positions', 'sections',
+                 'embeddings', '_id_array', '_rows')
+
+    def __init__(self):
+        self.names = []
+        self.urls = []
+        self.titles = []
+        self.keys = []
+        self.ids = []
+        self.positions = []
+        self.sections = []
+        self.embeddings = None
+        self._id_array = None
+        self._rows = None
+
+    def append(self, name: str, url: str, key: str, pid: int, title: str, position: int = -1, section: str = ''):
+        """Add a link row (pid must be page_id(key))."""
+        self.names.append(name)
+        self.urls.append(url)
+        self.keys.append(key)
+        self.ids.append(pid)
+        self.titles.append(title)
+        self.positions.append(position)
+        self.sections.append(section)
+        self._id_array = None
+        self._rows = None
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __getitem__(self, row: int) -> dict:
+        """Materialize one row as a link dict."""
+        return {
+            'name': self.names[row],
+            'url': self.urls[row],
+            'title': self.titles[row],
+            'id': self.ids[row],
+            'position': self.positions[row],
+            'section': self.sections[row],
+        }
+
+    def __iter__(self):
+        for row in range(len(self)):
+            yield self[row]
+
+    @property
+    def id_array(self) -> np.ndarray:
+        """Page IDs as an int64 array."""
+        if self._id_array is None:
+            self._id_array = np.fromiter(self.ids, dtype=np.int64, count=len(self.ids))
+        return self._id_array
+
+    def index_of(self, pid: int) -> int:
+        """Row of the given page ID, or None if this page does not link to it."""
+        if self._rows is None:
+            self._rows = {}
+            for row, link_id in enumerate(self.ids):
+                self._rows.setdefault(link_id, row)
+        return self._rows.get(pid)
+
+    def __contains__(self, pid: int) -> bool:
+        return self.index_of(pid) is not None
+
+    def mask_ids(self, ids: set) -> np.ndarray:
+        """Boolean mask of rows whose page ID is in ids."""
+        if not ids:
+            return np.zeros(len(self), dtype=bool)
+        return np.isin(self.id_array, np.fromiter(ids, dtype=np.int64, count=len(ids)))
+
+    def to_dict(self) -> dict:
+        """
+        Plain-data form of the table (without embeddings).
+
+        Page IDs are only valid for the current race, so canonical keys are
+        stored instead and re-interned by from_dict.
+        """
+        return {
+            'names': self.names,
+            'urls': self.urls,
+            'titles': self.titles,
+            'keys': self.keys,
+            'positions': self.positions,
+            'sections': self.sections,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'LinkTable':
+        """Rebuild a table produced by to_dict."""
+        table = cls()
+        table.names = list(data['names'])
+        table.urls = list(data['urls'])
+        table.titles = [sys.intern(title) for title in data['titles']]
+        table.keys = [sys.intern(key) for key in data['keys']]
+        table.ids = [page_id(key) for key in table.keys]
+        table.positions = list(data['positions'])
+        table.sections = list(data['sections'])
+        return table
+
+    def take(self, rows) -> 'LinkTable':
+        """New table holding only the given rows (and their embeddings, if any)."""
+        rows = np.asarray(rows, dtype=np.int64)
+        table = LinkTable()
+        table.names = [self.names[i] for i in rows]
+        table.urls = [self.urls[i] for i in rows]
+        table.titles = [self.titles[i] for i in rows]
+        table.keys = [self.keys[i] for i in rows]
+        table.ids = [self.ids[i] for i in rows]
+        table.positions = [self.positions[i] for i in rows]
+        table.sections = [self.sections[i] for i in rows]
+        if self.embeddings is not None:
+            table.embeddings = self.embeddings[rows]
+        return table
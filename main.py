@@ -1,7 +1,10 @@
 import os
 import sys
+import time
 from urllib.parse import urlparse
 
+import numpy as np
+
 # Add current directory to path for imports
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
@@ -12,22 +15,84 @@ html_scrape = importlib.util.module_from_spec(spec)
 spec.loader.exec_module(html_scrape)
 scrape_wikipedia_links = html_scrape.scrape_wikipedia_links
 
-from embeddings import EmbeddingStore
+from embeddings import DEFAULT_MEMORY_BUDGET, EmbeddingStore
+from fetcher import FetchScheduler, PRIORITY_TARGET
+from lexical import LexicalPrefilter
+from link_table import LinkTable, page_id, page_id_for_url, page_key, reset_page_ids
+from mediawiki_api import article_path, fetch_links_api, fetch_links_api_batch
+from prefetch import Prefetcher
+from runlog import RunLog
+
+# Selectable per deployment via WIKIRACER_LINK_SOURCE
+LINK_SOURCES = {
+    'html': scrape_wikipedia_links,
+    'api': fetch_links_api,
+}
+
+# Link sources that can fetch several pages in one request, used for speculation
+BATCH_LINK_SOURCES = {
+    'api': fetch_links_api_batch,
+}
 
 
 class WikiRacer:
-    def __init__(self, db_path: str = None, demo_mode: bool = False):
-        self.embedding_store = EmbeddingStore(db_path)
+    def __init__(self, db_path: str = None, demo_mode: bool = False,
+                 prefilter_top_n: int = None, measure_prefilter_recall: bool = False,
+                 target_context_links: int = 0, scheduler=None, link_source: str = None,
+                 embedding_dtype: str = 'float32', memory_budget: int = DEFAULT_MEMORY_BUDGET,
+                 speculation_depth: int = 0, speculation_byte_budget: int = None,
+                 run_log: RunLog = None):
+        self.embedding_store = EmbeddingStore(db_path, embedding_dtype, memory_budget)
         self.path_history = []
-        self.visited_urls = set()
+        self.visited_ids = set()
+        self.target_id = None
         self.max_depth = 20
         self.demo_mode = demo_mode
         self.visualizer = None
 
+        # Optional lexical stage that shrinks the set of links to embed
+        self.prefilter = LexicalPrefilter(prefilter_top_n) if prefilter_top_n else None
+        self.measure_prefilter_recall = measure_prefilter_recall
+
+        # Target embedding, built once per race
+        self.target_profile = None
+        self.target_context_links = target_context_links
+
+        # Optional shared FetchScheduler for rate limiting and retries
+        self.scheduler = scheduler
+
+        # Callable(url, scheduler, priority) returning scraped page data
+        link_source = link_source or os.environ.get('WIKIRACER_LINK_SOURCE', 'html')
+        if link_source not in LINK_SOURCES:
+            raise ValueError(f"Unknown link source: {link_source} (expected one of {', '.join(LINK_SOURCES)})")
+        self.link_source = LINK_SOURCES[link_source]
+        self.batch_source = BATCH_LINK_SOURCES.get(link_source)
+
+        # Optional background fetching of the likeliest next pages
+        self.prefetcher = None
+        self.speculation_ranker = self.prefilter or LexicalPrefilter()
+        if speculation_depth:
+            self.prefetcher = Prefetcher(self.link_source, scheduler, speculation_depth, speculation_byte_budget,
+                                         self.batch_source)
+
+        # Durable per-race/per-step records (also enabled by WIKIRACER_RUN_LOG)
+        if run_log is None and os.environ.get('WIKIRACER_RUN_LOG'):
+            run_log = RunLog(os.environ['WIKIRACER_RUN_LOG'])
+        self.run_log = run_log
+        self._race = None
+        self._step_stats = None
+
         if demo_mode:
             from visualizer import get_visualizer
             self.visualizer = get_visualizer()
 
+    def close(self):
+        """Stop background prefetching and flush the run log; call once the racer is no longer needed."""
+        if self.prefetcher:
+            self.prefetcher.close()
+        if self.run_log:
+            self.run_log.flush()
+
     def _get_page_name_from_url(self, url: str) -> str:
         """Extract the page name from a Wikipedia URL."""
         parsed = urlparse(url)
@@ -36,45 +101,193 @@ class WikiRacer:
             return path.split('/wiki/')[-1].replace('_', ' ')
         return url
 
-    def _normalize_url(self, url: str) -> str:
-        """Normalize URL for comparison (lowercase path)."""
-        parsed = urlparse(url)
-        return parsed.path.lower()
-
-    def _scrape_and_embed(self, url: str) -> tuple:
+    def _scrape_and_embed(self, url: str, target_name: str = None) -> tuple:
         """
         Scrape a Wikipedia page and store embeddings.
 
+        When a prefilter is configured, only its top unvisited candidates for
+        target_name are embedded; data['links'] still holds every link. With
+        speculation enabled, the likeliest next pages start downloading
+        before the embedding work begins.
+
         Returns:
-            tuple: (links_data, collection) or (None, None) if failed
+            tuple: (links_data, candidates), where candidates is the embedded
+            LinkTable, or (None, None) if failed
         """
         print(f"\nScraping: {url}")
 
         if self.visualizer:
             self.visualizer.show_status("Scraping page and analyzing links...")
 
-        data = scrape_wikipedia_links(url)
+        stats = self._step_stats = {'fetch_s': 0.0, 'embed_s': 0.0, 'prefetch_hit': False,
+                                    'cache_hits': 0, 'cache_misses': 0, 'links': 0, 'candidates': 0}
+        fetch_started = time.perf_counter()
+
+        if self.prefetcher:
+            prefetch_hits = self.prefetcher.stats['hits']
+            data = self.prefetcher.get(url)
+            stats['prefetch_hit'] = self.prefetcher.stats['hits'] > prefetch_hits
+        else:
+            data = self.link_source(url, self.scheduler)
+
+        stats['fetch_s'] = time.perf_counter() - fetch_started
+        if self._race:
+            self._race['pages_fetched'] += 1
 
         if not data or not data['links']:
             print("Failed to scrape or no links found.")
             return None, None
 
         print(f"Found {len(data['links'])} links on '{data['source_page']}'")
+        embed_started = time.perf_counter()
+        reused_rows, encoded_rows = self._cache_counts()
+        stats['links'] = len(data['links'])
+
+        if self.prefetcher and target_name and self.target_id not in data['links']:
+            self._speculate(data['links'], target_name)
+
+        candidates = data['links']
+        if self.prefilter and target_name:
+            candidates = self._prefilter_links(candidates, target_name)
+            if not candidates:
+                stats['embed_s'] = time.perf_counter() - embed_started
+                return data, candidates
 
         if self.visualizer:
             self.visualizer.show_status(f"Found {len(data['links'])} links, creating embeddings...")
 
-        collection = self.embedding_store.store_links(data['links'])
-        return data, collection
+        # Reuse whatever the workspace has for this page and revision
+        self.embedding_store.embed_page(self._page_key(url, data), data.get('revision_id'),
+                                        data['links'], candidates)
+
+        reused_after, encoded_after = self._cache_counts()
+        stats['cache_hits'] = reused_after - reused_rows
+        stats['cache_misses'] = encoded_after - encoded_rows
+        stats['candidates'] = len(candidates)
+        stats['embed_s'] = time.perf_counter() - embed_started
+        return data, candidates
+
+    def _page_key(self, url: str, data: dict) -> str:
+        """Canonical key for a fetched page, following redirects when known."""
+        if data.get('canonical_title'):
+            return page_key(article_path(data['canonical_title']))
+        return page_key(urlparse(url).path)
+
+    def _cache_counts(self) -> tuple:
+        """Cumulative rows the page workspace reused and encoded (cache hits and misses)."""
+        stats = self.embedding_store.workspace.stats
+        return stats['reused_rows'], stats['encoded_rows']
+
+    def _speculate(self, links: LinkTable, target_name: str):
+        """Prefetch the pages of the best unvisited links by lexical score."""
+        scores = self.speculation_ranker.score(links, target_name)
+        scores[links.mask_ids(self.visited_ids)] = -np.inf
+
+        count = min(self.prefetcher.depth, len(links))
+        top = np.argpartition(-scores, count - 1)[:count]
+        top = top[np.argsort(-scores[top])]
+        self.prefetcher.speculate([links.urls[row] for row in top if scores[row] > -np.inf])
+
+    def _prefilter_links(self, links: LinkTable, target_name: str) -> LinkTable:
+        """Drop visited links and keep the prefilter's top lexical candidates."""
+        unvisited = links.take(np.flatnonzero(~links.mask_ids(self.visited_ids)))
+        selected = self.prefilter.select(unvisited, target_name)
+        print(f"Prefilter kept {len(selected)} of {len(unvisited)} unvisited links")
+
+        if self.measure_prefilter_recall and unvisited and len(selected) < len(unvisited):
+            self.embedding_store.store_links(unvisited, index=False)
+            full_matches = self.embedding_store.rank_links(
+                self.target_profile, unvisited, n_results=self.prefilter.recall_k
+            )
+            recall = self.prefilter.record_recall(selected, full_matches)
+            print(f"Prefilter recall@{self.prefilter.recall_k}: {recall:.2f} (mean {self.prefilter.mean_recall():.2f})")
+
+        return selected
 
-    def _check_for_target(self, links: list, target_url: str) -> dict:
-        """Check if the target URL is in the current page's links."""
-        target_path = self._normalize_url(target_url)
+    def _build_target_profile(self, target_url: str, target_name: str):
+        """
+        Embed the target once per race.
 
-        for link in links:
-            if self._normalize_url(link['url']) == target_path:
-                return link
-        return None
+        If target_context_links is set, the target page is fetched once and
+        the names of its first lead-section links are added as extra vectors.
+        Link sources without section data (the api source) contribute the
+        page's first links instead.
+        """
+        context = []
+        if self.target_context_links:
+            print(f"\nFetching target page for context: {target_url}")
+            data = self.link_source(target_url, self.scheduler, PRIORITY_TARGET)
+            self._race['pages_fetched'] += 1
+            if data and data['links']:
+                links = data['links']
+                if any(links.sections):
+                    context = [name for name, section in zip(links.names, links.sections)
+                               if section == 'Lead'][:self.target_context_links]
+                    print(f"Using {len(context)} lead-section links as target context")
+                else:
+                    context = links.names[:self.target_context_links]
+                    print(f"Using the first {len(context)} links as target context (no section data)")
+
+        return self.embedding_store.build_target_profile(target_name, context)
+
+    def _record_step(self, step: int, url: str, step_started: float, chosen: dict = None,
+                     found_target: bool = False, rank_s: float = 0.0):
+        """Append one step to the run log, if enabled."""
+        if not self.run_log:
+            return
+
+        stats = self._step_stats or {}
+        self.run_log.add_step(
+            race_id=self._race['race_id'],
+            step=step,
+            url=url,
+            chosen_name=chosen['name'] if chosen else '',
+            chosen_url=chosen['url'] if chosen else '',
+            distance=chosen.get('distance') if chosen else None,
+            links=stats.get('links', 0),
+            candidates=stats.get('candidates', 0),
+            found_target=found_target,
+            fetch_s=stats.get('fetch_s', 0.0),
+            embed_s=stats.get('embed_s', 0.0),
+            rank_s=rank_s,
+            step_s=time.perf_counter() - step_started,
+            prefetch_hit=stats.get('prefetch_hit', False),
+            cache_hits=stats.get('cache_hits', 0),
+            cache_misses=stats.get('cache_misses', 0),
+        )
+
+    def _finish_race(self, outcome: str, success: bool):
+        """Discard speculation that will never be used and record the race."""
+        if self.prefetcher:
+            self.prefetcher.reset()
+        self._record_race(outcome, success)
+
+    def _record_race(self, outcome: str, success: bool):
+        """Append the finished race to the run log, if enabled."""
+        if not self.run_log:
+            return
+
+        race = self._race
+        speculated = self.prefetcher.stats['speculated'] - race['speculated'] if self.prefetcher else 0
+        self.run_log.add_race(
+            race_id=race['race_id'],
+            start_url=race['start_url'],
+            end_url=race['end_url'],
+            outcome=outcome,
+            success=success,
+            steps=len(self.path_history) - 1,
+            pages_fetched=race['pages_fetched'],
+            speculated=speculated,
+            started=race['started'],
+            seconds=time.time() - race['started'],
+        )
+
+    def _check_for_target(self, links: LinkTable, target_id: int) -> dict:
+        """Check if the target page is in the current page's links."""
+        row = links.index_of(target_id)
+        if row is None:
+            return None
+        return links[row]
 
     def _log_step(self, step_num: int, name: str, url: str, is_final: bool = False):
         """Log a step in the path."""
@@ -110,8 +323,29 @@ class WikiRacer:
             bool: True if target was reached, False otherwise
         """
         self.path_history = []
-        self.visited_urls = set()
+        self.visited_ids = set()
+
+        # Drop speculation from the last race before its page IDs go away
+        if self.prefetcher:
+            self.prefetcher.reset()
+        reset_page_ids()
+
         target_name = self._get_page_name_from_url(end_url)
+        target_id = page_id_for_url(end_url)
+        self.target_id = target_id
+
+        if self.prefetcher:
+            self.prefetcher.link_source = self.link_source
+            self.prefetcher.batch_source = self.batch_source
+
+        self._race = {
+            'race_id': RunLog.new_race_id(),
+            'start_url': start_url,
+            'end_url': end_url,
+            'started': time.time(),
+            'pages_fetched': 0,
+            'speculated': self.prefetcher.stats['speculated'] if self.prefetcher else 0,
+        }
 
         print("\n" + "="*60)
         print("  WIKIRACER - Semantic Wikipedia Navigator")
@@ -124,13 +358,15 @@ class WikiRacer:
         if self.visualizer:
             self.visualizer.show_status(f"Starting race to '{target_name}'", step=0)
 
+        self.target_profile = self._build_target_profile(end_url, target_name)
+
         current_url = start_url
         step = 0
 
         # Log and mark starting point as visited
         start_name = self._get_page_name_from_url(start_url)
         self._log_step(step, start_name, start_url)
-        self.visited_urls.add(self._normalize_url(start_url))
+        self.visited_ids.add(page_id_for_url(start_url))
 
         # Navigate to start page in visualizer
         if self.visualizer:
@@ -143,18 +379,25 @@ class WikiRacer:
                 self.visualizer.show_status(f"Step {step}: Analyzing current page...", step=step)
 
             # Scrape current page and create embeddings
-            data, collection = self._scrape_and_embed(current_url)
+            step_started = time.perf_counter()
+            data, candidates = self._scrape_and_embed(current_url, target_name)
 
             if data is None:
                 print(f"\nFailed to process page. Stopping at step {step}.")
                 if self.visualizer:
                     self.visualizer.show_failure("Failed to process page")
+                self._record_step(step, current_url, step_started)
+                self._finish_race('fetch_failed', False)
                 return False
 
             links = data['links']
 
+            # Both link sources report where redirects landed; don't come back there either
+            if data.get('canonical_title'):
+                self.visited_ids.add(page_id(self._page_key(current_url, data)))
+
             # Check if target is directly linked
-            target_link = self._check_for_target(links, end_url)
+            target_link = self._check_for_target(links, target_id)
             if target_link:
                 if self.visualizer:
                     self.visualizer.show_status(f"Found target link: {target_link['name']}!", step=step)
@@ -166,29 +409,30 @@ class WikiRacer:
                     self.visualizer.click_link(target_link['url'])
                     self.visualizer.show_success(self.path_history)
 
+                self._record_step(step, current_url, step_started, target_link, found_target=True)
+                self._finish_race('target_linked', True)
                 self._print_summary(True)
                 return True
 
             # Find the closest unvisited link semantically
-            visited_full_urls = set()
-            for link in links:
-                if self._normalize_url(link['url']) in self.visited_urls:
-                    visited_full_urls.add(link['url'])
-
             if self.visualizer:
                 self.visualizer.show_status(f"Searching for best link to '{target_name}'...", step=step)
 
-            matches = self.embedding_store.find_closest(
-                target_name,
-                collection,
+            rank_started = time.perf_counter()
+            matches = self.embedding_store.rank_links(
+                self.target_profile,
+                candidates,
                 n_results=1,
-                exclude_urls=visited_full_urls
+                exclude_ids=self.visited_ids
             )
+            rank_s = time.perf_counter() - rank_started
 
             if not matches:
                 print(f"\nNo unvisited links found. Stopping at step {step}.")
                 if self.visualizer:
                     self.visualizer.show_failure("No unvisited links found")
+                self._record_step(step, current_url, step_started, rank_s=rank_s)
+                self._finish_race('no_unvisited_links', False)
                 self._print_summary(False)
                 return False
 
@@ -201,24 +445,28 @@ class WikiRacer:
                 self.visualizer.highlight_link(closest['url'], closest['name'])
 
             # Mark as visited and move to the closest link
-            self.visited_urls.add(self._normalize_url(closest['url']))
+            self.visited_ids.add(closest['id'])
             self._log_step(step, closest['name'], closest['url'])
 
             if self.visualizer:
                 self.visualizer.click_link(closest['url'])
 
+            self._record_step(step, current_url, step_started, closest,
+                              found_target=closest['id'] == target_id, rank_s=rank_s)
             current_url = closest['url']
 
             # Check if we've reached the target
-            if self._normalize_url(current_url) == self._normalize_url(end_url):
+            if closest['id'] == target_id:
                 if self.visualizer:
                     self.visualizer.show_success(self.path_history)
+                self._finish_race('reached_target', True)
                 self._print_summary(True)
                 return True
 
         print(f"\nMax depth ({self.max_depth}) reached without finding target.")
         if self.visualizer:
             self.visualizer.show_failure(f"Max depth ({self.max_depth}) reached")
+        self._finish_race('max_depth', False)
         self._print_summary(False)
         return False
 
@@ -238,6 +486,17 @@ class WikiRacer:
             print(f"  SUCCESS! Reached target in {len(self.path_history) - 1} steps.")
         else:
             print(f"  FAILED. Could not reach target in {len(self.path_history) - 1} steps.")
+
+        if self.prefetcher:
+            metrics = self.prefetcher.metrics()
+            print(f"  Prefetch: {metrics['hits']} hits / {metrics['misses']} misses "
+                  f"(hit rate {metrics['hit_rate']:.0%}), {metrics['speculated']} speculated, "
+                  f"{metrics['cancelled'] + metrics['wasted']} discarded, {metrics['bytes'] / 1024:.0f} KB")
+
+        for cache in self.embedding_store.memory_report()['caches']:
+            print(f"  Cache '{cache['name']}' ({cache['dtype']}): {cache['entries']} links, "
+                  f"{cache['bytes'] / 1024:.0f} KB allocated, {cache['bytes_per_link']:.0f} bytes/link, "
+                  f"hit rate {cache['hit_rate']:.0%}")
         print("="*60 + "\n")
 
 
@@ -289,8 +548,13 @@ def main():
             demo_mode = False
 
     # Run the racer
-    racer = WikiRacer(demo_mode=demo_mode)
-    racer.race(start_url, end_url)
+    scheduler = FetchScheduler()
+    racer = WikiRacer(demo_mode=demo_mode, scheduler=scheduler)
+    try:
+        racer.race(start_url, end_url)
+    finally:
+        racer.close()
+        scheduler.shutdown()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,209 @@
+import os
+from concurrent.futures import CancelledError
+from urllib.parse import quote, unquote, urlencode, urlparse
+
+import requests
+
+from fetcher import DEFAULT_HEADERS, PRIORITY_NORMAL
+from link_table import LinkTable, page_id, page_key
+
+# Overridable per deployment with WIKIRACER_API_URL and WIKIRACER_ARTICLE_BASE
+DEFAULT_API_URL = 'https://en.wikipedia.org/w/api.php'
+DEFAULT_ARTICLE_BASE = 'https://en.wikipedia.org'
+
+# The Action API accepts at most 50 titles per query for normal clients
+BATCH_SIZE = 50
+
+# Characters MediaWiki leaves unescaped in article paths
+PATH_SAFE = ";@$!*(),/~:"
+
+
+def title_from_url(url: str) -> str:
+    """Article title from a /wiki/ URL."""
+    path = urlparse(url).path
+    return unquote(path.split('/wiki/', 1)[-1]).replace('_', ' ')
+
+
+def article_path(title: str) -> str:
+    """The /wiki/ path MediaWiki would use for a title."""
+    return '/wiki/' + quote(title.replace(' ', '_'), safe=PATH_SAFE)
+
+
+def article_base_from_url(url: str) -> str:
+    """Scheme and host of an article URL, e.g. https://en.wikipedia.org."""
+    parsed = urlparse(url)
+    return f"{parsed.scheme}://{parsed.netloc}"
+
+
+def _get(api_url: str, params: dict, scheduler=None, priority: int = PRIORITY_NORMAL) -> requests.Response:
+    url = f"{api_url}?{urlencode(params)}"
+    if scheduler:
+        response = scheduler.fetch(url, priority)
+    else:
+        response = requests.get(url, headers=DEFAULT_HEADERS)
+        response.raise_for_status()
+    return response
+
+
+def fetch_links_batch(titles: list, api_url: str = None, scheduler=None,
+                      priority: int = PRIORITY_NORMAL, article_base: str = None) -> dict:
+    """
+    Fetch the article links of many pages through the MediaWiki Action API.
+
+    Titles are sent in batches of up to 50 per request (prop=links|info,
+    plnamespace=0, redirects=1), following API continuation until every
+    page's links are complete.
+
+    Args:
+        titles: Page titles to fetch
+        api_url: api.php endpoint (defaults to WIKIRACER_API_URL or English Wikipedia)
+        scheduler: Optional FetchScheduler
+        priority: Scheduler lane for these requests
+        article_base: Scheme and host that /wiki/ link paths are joined to
+            (defaults to WIKIRACER_ARTICLE_BASE or English Wikipedia)
+
+    Returns:
+        dict: Requested title -> page data in the same shape as
+            scrape_wikipedia_links, plus 'canonical_title' and 'redirects'.
+            Missing pages are left out. 'revision_id' is the page's latest
+            revision.
+    """
+    api_url = api_url or os.environ.get('WIKIRACER_API_URL', DEFAULT_API_URL)
+    article_base = article_base or os.environ.get('WIKIRACER_ARTICLE_BASE', DEFAULT_ARTICLE_BASE)
+    results = {}
+
+    for start in range(0, len(titles), BATCH_SIZE):
+        batch = titles[start:start + BATCH_SIZE]
+        params = {
+            'action': 'query',
+            'format': 'json',
+            'formatversion': '2',
+            'prop': 'links|info',
+            'plnamespace': '0',
+            'pllimit': 'max',
+            'redirects': '1',
+            'titles': '|'.join(batch),
+        }
+
+        normalized = {}
+        redirects = {}
+        page_links = {}
+        revisions = {}
+        batch_bytes = 0
+
+        while True:
+            raw = _get(api_url, params, scheduler, priority)
+            batch_bytes += len(raw.content)
+            response = raw.json()
+            query = response.get('query', {})
+
+            for entry in query.get('normalized', []):
+                normalized[entry['from']] = entry['to']
+            for entry in query.get('redirects', []):
+                redirects[entry['from']] = entry['to']
+            for page in query.get('pages', []):
+                if page.get('missing') or page.get('invalid'):
+                    continue
+                if 'lastrevid' in page:
+                    revisions[page['title']] = page['lastrevid']
+                links = page_links.setdefault(page['title'], [])
+                links.extend(link['title'] for link in page.get('links', []))
+
+            if 'continue' not in response:
+                break
+            params = {**params, **response['continue']}
+
+        for title in batch:
+            canonical = normalized.get(title, title)
+            redirect_chain = []
+            while canonical in redirects:
+                redirect_chain.append({'from': canonical, 'to': redirects[canonical]})
+                canonical = redirects[canonical]
+
+            if canonical not in page_links:
+                continue
+
+            table = LinkTable()
+            seen_ids = set()
+            for link_title in page_links[canonical]:
+                path = article_path(link_title)
+                key = page_key(path)
+                pid = page_id(key)
+                if pid not in seen_ids:
+                    seen_ids.add(pid)
+                    table.append(link_title, article_base + path, key, pid, link_title)
+
+            results[title] = {
+                'source_page': canonical,
+                'source_url': article_base + article_path(canonical),
+                'canonical_title': canonical,
+                'redirects': redirect_chain,
+                'revision_id': revisions.get(canonical),
+                'total_links': len(table),
+                'links': table,
+                'bytes': batch_bytes // len(batch)
+            }
+
+    return results
+
+
+def fetch_links_api(url, scheduler=None, priority=PRIORITY_NORMAL, api_url=None):
+    """
+    Drop-in replacement for scrape_wikipedia_links backed by the Action API.
+
+    Links carry their titles as names and have no position or section, and
+    the payload is a small JSON document instead of the rendered article.
+
+    Args:
+        url (str): The Wikipedia page URL
+        scheduler (FetchScheduler): Optional rate-limited fetcher
+        priority (int): Scheduler lane for this request
+        api_url (str): api.php endpoint override
+
+    Returns:
+        dict: Page data as from scrape_wikipedia_links, or None on failure
+    """
+    return fetch_links_api_batch([url], scheduler, priority, api_url).get(url)
+
+
+def fetch_links_api_batch(urls, scheduler=None, priority=PRIORITY_NORMAL, api_url=None):
+    """
+    Fetch several pages with as few API requests as possible.
+
+    Used by the prefetcher to speculate on a page's likeliest next links in
+    one query. Link URLs use the same host as the requested pages.
+
+    Args:
+        urls (list): Wikipedia page URLs from one wiki
+        scheduler (FetchScheduler): Optional rate-limited fetcher
+        priority (int): Scheduler lane for these requests
+        api_url (str): api.php endpoint override
+
+    Returns:
+        dict: URL -> page data (as from fetch_links_api); pages that are
+            missing or failed to load are left out
+    """
+    if not urls:
+        return {}
+
+    titles = {url: title_from_url(url) for url in urls}
+    try:
+        pages = fetch_links_batch(list(dict.fromkeys(titles.values())), api_url, scheduler, priority,
+                                  article_base_from_url(urls[0]))
+    except CancelledError:
+        # A speculative fetch the prefetcher gave up on
+        raise
+    except requests.exceptions.RequestException as e:
+        print(f"Error fetching the page: {e}")
+        return {}
+    except Exception as e:
+        print(f"Error processing the page: {e}")
+        return {}
+
+    results = {}
+    for url, title in titles.items():
+        if title in pages:
+            results[url] = {**pages[title], 'source_url': url}
+        else:
+            print(f"Page not found: {title}")
+    return results
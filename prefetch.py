@@ -0,0 +1,185 @@
+import threading
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor
+
+from fetcher import PRIORITY_NORMAL, PRIORITY_PREFETCH
+from link_table import page_id_for_url
+
+
+class SpeculativeScheduler:
+    """
+    Scheduler handed to a link source for one speculative fetch.
+
+    Requests go through the real scheduler's prefetch lane, and the future
+    of the current one is kept so that cancel() can drop it while it is
+    still queued. After cancel(), further requests raise CancelledError.
+    """
+
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+        self.refs = 0
+        self.cancelled = False
+        self.future = None
+        self._lock = threading.Lock()
+
+    def fetch(self, url: str, priority: int = PRIORITY_PREFETCH):
+        with self._lock:
+            if self.cancelled:
+                raise CancelledError()
+            self.future = self.scheduler.submit(url, priority)
+        return self.future.result()
+
+    def cancel(self) -> bool:
+        """Stop the speculation; True if no request of it had started yet."""
+        with self._lock:
+            self.cancelled = True
+            return self.future is None or self.future.cancel()
+
+
+class Prefetcher:
+    """
+    Speculative page fetcher for the greedy racer.
+
+    While the current page is being embedded and ranked, the pages of its
+    most likely next links are fetched in the background. The racer then
+    asks for the page it actually chose; if that page was speculated it is
+    served from the buffer, otherwise it is fetched directly. Speculations
+    that drop out of the candidate set, or lose to the page actually chosen,
+    are cancelled: fetches waiting in the scheduler's prefetch lane are
+    dropped from its queue, and only requests already on the wire finish
+    and are discarded.
+
+    With a batch_source (e.g. fetch_links_api_batch), the new pages of each
+    speculation round are fetched together in a single request.
+    """
+
+    def __init__(self, link_source, scheduler=None, depth: int = 3, byte_budget: int = None,
+                 batch_source=None):
+        self.link_source = link_source
+        self.batch_source = batch_source
+        self.scheduler = scheduler
+        self.depth = depth
+        self.byte_budget = byte_budget
+        self.executor = ThreadPoolExecutor(max_workers=depth, thread_name_prefix="prefetch")
+        self.pending = {}
+        self.race_bytes = 0
+        self.stats = {'speculated': 0, 'hits': 0, 'misses': 0, 'cancelled': 0, 'wasted': 0, 'bytes': 0}
+
+    def reset(self):
+        """Drop all speculation and restart the per-race byte budget."""
+        self._discard(set(self.pending))
+        self.race_bytes = 0
+
+    def speculate(self, urls: list):
+        """
+        Make the given URLs (best first) the current speculation set.
+
+        Pending fetches for other pages are cancelled, and up to depth of the
+        given URLs are fetched in the background while budget remains.
+        """
+        wanted = {}
+        for url in urls[:self.depth]:
+            wanted[page_id_for_url(url)] = url
+
+        self._discard(set(self.pending) - set(wanted))
+
+        batch = []
+        batch_speculation = self._speculation()
+        for pid, url in wanted.items():
+            if pid in self.pending:
+                continue
+            if self.byte_budget is not None and self.race_bytes >= self.byte_budget:
+                break
+            if self.batch_source:
+                speculation = batch_speculation
+                future = Future()
+                batch.append((url, future))
+            else:
+                speculation = self._speculation()
+                future = self.executor.submit(self._fetch, url, speculation)
+            if speculation:
+                speculation.refs += 1
+            self.pending[pid] = (future, speculation)
+            self.stats['speculated'] += 1
+
+        if batch:
+            self.executor.submit(self._fetch_batch, batch, batch_speculation)
+
+    def get(self, url: str):
+        """Page data for url, from the speculation buffer if possible."""
+        entry = self.pending.pop(page_id_for_url(url), None)
+        # The racer moved to url, so the other speculated pages are dead ends
+        self._discard(set(self.pending))
+
+        if entry is not None:
+            future, _ = entry
+            try:
+                data = future.result()
+            except Exception as e:
+                # A failed speculation is just a miss; fetch it again directly
+                print(f"Prefetch of {url} failed: {e}")
+                data = None
+            if data:
+                self.stats['hits'] += 1
+                return data
+
+        self.stats['misses'] += 1
+        return self.link_source(url, self.scheduler, PRIORITY_NORMAL)
+
+    def hit_rate(self) -> float:
+        lookups = self.stats['hits'] + self.stats['misses']
+        return self.stats['hits'] / lookups if lookups else 0.0
+
+    def metrics(self) -> dict:
+        return {**self.stats, 'hit_rate': self.hit_rate()}
+
+    def close(self):
+        """Discard speculation and wait for in-flight fetches to finish."""
+        self.reset()
+        self.executor.shutdown(wait=True)
+
+    def _speculation(self):
+        return SpeculativeScheduler(self.scheduler) if self.scheduler else None
+
+    def _fetch(self, url: str, speculation: SpeculativeScheduler):
+        data = self.link_source(url, speculation, PRIORITY_PREFETCH)
+        if data:
+            size = data.get('bytes', 0)
+            self.race_bytes += size
+            self.stats['bytes'] += size
+        return data
+
+    def _fetch_batch(self, batch: list, speculation: SpeculativeScheduler):
+        # Pages cancelled before the request starts are left out of it
+        batch = [(url, future) for url, future in batch if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        try:
+            pages = self.batch_source([url for url, _ in batch], speculation, PRIORITY_PREFETCH)
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        for url, future in batch:
+            data = pages.get(url)
+            if data:
+                size = data.get('bytes', 0)
+                self.race_bytes += size
+                self.stats['bytes'] += size
+            future.set_result(data)
+
+    def _discard(self, pids: set):
+        for pid in pids:
+            future, speculation = self.pending.pop(pid)
+            # A batch speculation is shared by several pages; stop it with the last one
+            last = False
+            if speculation:
+                speculation.refs -= 1
+                last = speculation.refs == 0
+
+            if future.cancel():
+                cancelled = True
+            else:
+                # Already running: drop its request from the scheduler queue if still there
+                cancelled = last and speculation.cancel()
+            self.stats['cancelled' if cancelled else 'wasted'] += 1
@@ -0,0 +1,291 @@
+import sys
+from collections import OrderedDict
+
+import numpy as np
+
+STORAGE_DTYPES = {
+    'float32': np.float32,
+    'float16': np.float16,
+    'int8': np.int8,
+}
+
+# Rows upcast to float32 at a time when scoring, so the temporary stays cache-sized
+SCORE_BLOCK_ROWS = 4096
+
+
+class QuantizedMatrix:
+    """
+    Embedding matrix stored as float32, float16 or int8.
+
+    int8 matrices are scalar-quantized per row: each row keeps a float32
+    scale and row * scale recovers the original vector. Scoring upcasts
+    blocks of rows to float32 and runs a BLAS matrix product on each block,
+    applying the row scales to the result rather than to the data.
+    """
+
+    __slots__ = ('data', 'scales')
+
+    def __init__(self, data: np.ndarray, scales: np.ndarray = None):
+        self.data = data
+        self.scales = scales
+
+    @classmethod
+    def from_float(cls, matrix: np.ndarray, dtype: str = 'float32') -> 'QuantizedMatrix':
+        """Quantize a float matrix to the given storage dtype."""
+        if dtype not in STORAGE_DTYPES:
+            raise ValueError(f"Unknown embedding dtype: {dtype} (expected one of {', '.join(STORAGE_DTYPES)})")
+
+        matrix = np.asarray(matrix, dtype=np.float32)
+        if dtype != 'int8':
+            return cls(matrix.astype(STORAGE_DTYPES[dtype], copy=False))
+
+        scales = np.abs(matrix).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        data = np.rint(matrix / scales[:, None]).astype(np.int8)
+        return cls(data, scales.astype(np.float32))
+
+    @classmethod
+    def empty(cls, rows: int, dim: int, dtype: str = 'float32') -> 'QuantizedMatrix':
+        scales = np.ones(rows, dtype=np.float32) if dtype == 'int8' else None
+        return cls(np.empty((rows, dim), dtype=STORAGE_DTYPES[dtype]), scales)
+
+    @property
+    def dtype(self) -> str:
+        return self.data.dtype.name
+
+    @property
+    def shape(self) -> tuple:
+        return self.data.shape
+
+    @property
+    def nbytes(self) -> int:
+        return self.data.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def __getitem__(self, rows) -> 'QuantizedMatrix':
+        scales = self.scales[rows] if self.scales is not None else None
+        return QuantizedMatrix(self.data[rows], scales)
+
+    def append(self, other: 'QuantizedMatrix') -> 'QuantizedMatrix':
+        """New matrix with the rows of other (same dtype) added at the end."""
+        scales = np.concatenate([self.scales, other.scales]) if self.scales is not None else None
+        return QuantizedMatrix(np.concatenate([self.data, other.data]), scales)
+
+    def assign(self, rows, other: 'QuantizedMatrix'):
+        """Copy the rows of another matrix of the same dtype into the given rows."""
+        self.data[rows] = other.data
+        if self.scales is not None:
+            self.scales[rows] = other.scales
+
+    def to_float(self) -> np.ndarray:
+        """Dequantize to a float32 matrix."""
+        matrix = self.data.astype(np.float32)
+        if self.scales is not None:
+            matrix *= self.scales[:, None]
+        return matrix
+
+    def scores(self, vectors: np.ndarray) -> np.ndarray:
+        """
+        Dot products of every row with each query vector.
+
+        Args:
+            vectors: float32 matrix of shape (k, dim)
+
+        Returns:
+            float32 matrix of shape (rows, k)
+        """
+        vectors_t = np.ascontiguousarray(np.asarray(vectors, dtype=np.float32).T)
+        if self.data.dtype == np.float32:
+            return self.data @ vectors_t
+
+        out = np.empty((len(self.data), vectors_t.shape[1]), dtype=np.float32)
+        for start in range(0, len(self.data), SCORE_BLOCK_ROWS):
+            block = self.data[start:start + SCORE_BLOCK_ROWS].astype(np.float32)
+            np.matmul(block, vectors_t, out=out[start:start + SCORE_BLOCK_ROWS])
+        if self.scales is not None:
+            out *= self.scales[:, None]
+        return out
+
+
+class MemoryBudget:
+    """
+    Byte limit shared by the embedding caches of a process.
+
+    Caches register themselves and call enforce() after growing. While the
+    total is over the limit, the largest cache is asked to shrink by the
+    excess. Caches provide nbytes() (bytes actually allocated, not just
+    live entries), shrink(nbytes) returning the bytes freed, and report().
+    """
+
+    def __init__(self, limit_bytes: int = None):
+        self.limit_bytes = limit_bytes
+        self.consumers = []
+
+    def register(self, consumer):
+        self.consumers.append(consumer)
+
+    def used(self) -> int:
+        return sum(consumer.nbytes() for consumer in self.consumers)
+
+    def room(self) -> int:
+        """Bytes left under the limit (None if unlimited)."""
+        if self.limit_bytes is None:
+            return None
+        return self.limit_bytes - self.used()
+
+    def enforce(self):
+        """Shrink caches until usage fits the limit."""
+        if self.limit_bytes is None:
+            return
+        while True:
+            excess = self.used() - self.limit_bytes
+            if excess <= 0:
+                return
+            largest = max(self.consumers, key=lambda consumer: consumer.nbytes())
+            if not largest.shrink(excess):
+                return
+
+    def report(self) -> dict:
+        """Usage per cache and in total."""
+        return {
+            'limit_bytes': self.limit_bytes,
+            'used_bytes': self.used(),
+            'caches': [consumer.report() for consumer in self.consumers],
+        }
+
+
+class EmbeddingCache:
+    """
+    LRU cache of text -> embedding row, stored quantized in one slab.
+
+    Rows live in a growable 2D array (plus per-row scales for int8); the
+    cache only maps keys to slot numbers, so each entry costs its vector
+    bytes and key instead of a separate NumPy array per entry. The whole
+    slab counts against the budget, free rows included: growth stops at
+    the budget's remaining room, and shrinking evicts least recently used
+    entries and then copies the survivors into a slab sized to fit them.
+    """
+
+    def __init__(self, name: str, dim: int, dtype: str, budget: MemoryBudget, initial_rows: int = 1024):
+        self.name = name
+        self.dtype = dtype
+        self.budget = budget
+        self.initial_rows = initial_rows
+        self.slab = QuantizedMatrix.empty(initial_rows, dim, dtype)
+        self.slots = OrderedDict()
+        self.free = list(range(initial_rows - 1, -1, -1))
+        self.key_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        budget.register(self)
+
+    def row_bytes(self) -> int:
+        return self.slab.data.shape[1] * self.slab.data.itemsize + (4 if self.slab.scales is not None else 0)
+
+    def nbytes(self) -> int:
+        """Bytes allocated for the slab (live and free rows) plus keys."""
+        return self.slab.nbytes + self.key_bytes
+
+    def live_bytes(self) -> int:
+        """Bytes held by live entries only."""
+        return len(self.slots) * self.row_bytes() + self.key_bytes
+
+    def shrink(self, nbytes: int) -> int:
+        """
+        Free at least nbytes if possible by evicting and compacting.
+
+        Survivors are compacted into a slab with 1/8 spare rows, so the next
+        few inserts don't immediately regrow it.
+
+        Returns:
+            Bytes actually freed
+        """
+        before = self.nbytes()
+        target = before - nbytes
+        row_bytes = self.row_bytes()
+
+        def compacted_bytes():
+            live = len(self.slots)
+            return (live + live // 8) * row_bytes + self.key_bytes
+
+        while self.slots and compacted_bytes() > target:
+            key, slot = self.slots.popitem(last=False)
+            self.key_bytes -= sys.getsizeof(key)
+            self.free.append(slot)
+
+        live = len(self.slots)
+        if live + live // 8 < len(self.slab):
+            self._compact(live + live // 8)
+        return before - self.nbytes()
+
+    def lookup(self, keys: list) -> np.ndarray:
+        """Slot for each key (-1 if missing), marking hits as recently used."""
+        slots = np.full(len(keys), -1, dtype=np.int64)
+        for i, key in enumerate(keys):
+            slot = self.slots.get(key)
+            if slot is not None:
+                self.slots.move_to_end(key)
+                slots[i] = slot
+        found = int((slots >= 0).sum())
+        self.hits += found
+        self.misses += len(keys) - found
+        return slots
+
+    def gather(self, slots: np.ndarray) -> QuantizedMatrix:
+        return self.slab[slots]
+
+    def put(self, keys: list, matrix: QuantizedMatrix):
+        """Insert rows for new keys, then let the budget evict if needed."""
+        rows = []
+        new_slots = []
+        for row, key in enumerate(keys):
+            if key in self.slots:
+                continue
+            if not self.free:
+                self._grow(len(keys) - row)
+            slot = self.free.pop()
+            self.slots[key] = slot
+            self.key_bytes += sys.getsizeof(key)
+            rows.append(row)
+            new_slots.append(slot)
+
+        if new_slots:
+            self.slab.assign(np.asarray(new_slots), matrix[np.asarray(rows)])
+        self.budget.enforce()
+
+    def _grow(self, needed: int):
+        """Add at least needed rows: double the slab, but not past the budget's room."""
+        old_rows, dim = self.slab.shape
+        growth = max(old_rows, self.initial_rows)
+        room = self.budget.room()
+        if room is not None:
+            growth = min(growth, max(room // self.row_bytes(), 0))
+        growth = max(growth, needed)
+
+        grown = QuantizedMatrix.empty(old_rows + growth, dim, self.dtype)
+        grown.assign(np.arange(old_rows), self.slab)
+        self.slab = grown
+        self.free.extend(range(old_rows + growth - 1, old_rows - 1, -1))
+
+    def _compact(self, rows: int):
+        live = len(self.slots)
+        compacted = QuantizedMatrix.empty(rows, self.slab.shape[1], self.dtype)
+        old_slots = np.fromiter(self.slots.values(), dtype=np.int64, count=live)
+        compacted.assign(np.arange(live), self.slab[old_slots])
+        self.slab = compacted
+        self.slots = OrderedDict(zip(self.slots.keys(), range(live)))
+        self.free = list(range(rows - 1, live - 1, -1))
+
+    def report(self) -> dict:
+        entries = len(self.slots)
+        return {
+            'name': self.name,
+            'dtype': self.dtype,
+            'entries': entries,
+            'bytes': self.nbytes(),
+            'live_bytes': self.live_bytes(),
+            'bytes_per_link': self.nbytes() / entries if entries else 0.0,
+            'hit_rate': self.hits / (self.hits + self.misses) if self.hits + self.misses else 0.0,
+        }
@@ -0,0 +1,164 @@
+"""
+Durable log of races and steps for offline performance analysis.
+
+Rows are buffered in memory and written in batches as column-oriented .npz
+chunks (one array per column) under a log directory. Each process writes
+its own chunk files, so several racers can share one directory.
+
+Usage:
+    python runlog.py report [LOG_DIR]
+"""
+import argparse
+import atexit
+import glob
+import os
+import uuid
+
+import numpy as np
+
+RACE_COLUMNS = {
+    'race_id': str, 'start_url': str, 'end_url': str, 'outcome': str,
+    'success': bool, 'steps': np.int32, 'pages_fetched': np.int32, 'speculated': np.int32,
+    'started': np.float64, 'seconds': np.float32,
+}
+
+STEP_COLUMNS = {
+    'race_id': str, 'step': np.int32, 'url': str, 'chosen_name': str, 'chosen_url': str,
+    'distance': np.float32, 'links': np.int32, 'candidates': np.int32, 'found_target': bool,
+    'fetch_s': np.float32, 'embed_s': np.float32, 'rank_s': np.float32, 'step_s': np.float32,
+    'prefetch_hit': bool, 'cache_hits': np.int32, 'cache_misses': np.int32,
+}
+
+TABLES = {'races': RACE_COLUMNS, 'steps': STEP_COLUMNS}
+
+DEFAULT_LOG_DIR = os.environ.get('WIKIRACER_RUN_LOG', 'runs')
+
+
+class RunLog:
+    """
+    Buffered writer for race and step rows.
+
+    Buffers are flushed at interpreter exit, but not when a multiprocessing
+    child exits; long-running processes such as distributed workers should
+    call flush() themselves.
+    """
+
+    def __init__(self, directory: str = DEFAULT_LOG_DIR, batch_size: int = 256):
+        self.directory = directory
+        self.batch_size = batch_size
+        self.buffers = {table: [] for table in TABLES}
+        self.chunk = 0
+        self.prefix = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        os.makedirs(directory, exist_ok=True)
+        atexit.register(self.flush)
+
+    @staticmethod
+    def new_race_id() -> str:
+        return uuid.uuid4().hex
+
+    def add_race(self, **row):
+        self._add('races', row)
+
+    def add_step(self, **row):
+        self._add('steps', row)
+
+    def _add(self, table: str, row: dict):
+        self.buffers[table].append(row)
+        if len(self.buffers[table]) >= self.batch_size:
+            self._write(table)
+
+    def flush(self):
+        """Write every buffered row."""
+        for table in TABLES:
+            self._write(table)
+
+    def _write(self, table: str):
+        rows = self.buffers[table]
+        if not rows:
+            return
+
+        columns = {}
+        for name, dtype in TABLES[table].items():
+            values = [row.get(name) for row in rows]
+            if dtype is str:
+                columns[name] = np.array(['' if value is None else str(value) for value in values])
+            elif dtype is bool:
+                columns[name] = np.array([bool(value) for value in values], dtype=bool)
+            else:
+                columns[name] = np.array([np.nan if value is None else value for value in values], dtype=dtype)
+
+        path = os.path.join(self.directory, f"{table}-{self.prefix}-{self.chunk:05d}.npz")
+        np.savez_compressed(path, **columns)
+        self.chunk += 1
+        self.buffers[table] = []
+
+
+def load(directory: str, table: str) -> dict:
+    """Concatenate every chunk of a table into one array per column."""
+    parts = {name: [] for name in TABLES[table]}
+    for path in sorted(glob.glob(os.path.join(directory, f"{table}-*.npz"))):
+        with np.load(path) as chunk:
+            for name in parts:
+                if name in chunk.files:
+                    parts[name].append(chunk[name])
+    return {name: np.concatenate(arrays) if arrays else np.array([]) for name, arrays in parts.items()}
+
+
+def _percentiles(values: np.ndarray) -> str:
+    values = values[~np.isnan(values)] if values.dtype.kind == 'f' else values
+    if not len(values):
+        return "n/a"
+    p50, p90, p99 = np.percentile(values, [50, 90, 99])
+    return f"p50 {p50:.3f}  p90 {p90:.3f}  p99 {p99:.3f}  max {values.max():.3f}"
+
+
+def report(directory: str):
+    """Print success rate, pages per race and latency percentiles."""
+    races = load(directory, 'races')
+    steps = load(directory, 'steps')
+
+    count = len(races['race_id'])
+    print("\n" + "="*60)
+    print(f"  RUN LOG REPORT: {directory}")
+    print("="*60)
+
+    if not count:
+        print("  No races recorded.")
+        return
+
+    print(f"\n  Races: {count}")
+    print(f"  Success rate: {races['success'].mean():.1%}")
+    outcomes, counts = np.unique(races['outcome'], return_counts=True)
+    for outcome, n in zip(outcomes, counts):
+        print(f"    {outcome}: {n}")
+
+    print(f"\n  Steps per race:        mean {races['steps'].mean():.1f}  {_percentiles(races['steps'].astype(np.float64))}")
+    print(f"  Pages fetched / race:  mean {races['pages_fetched'].mean():.1f}  {_percentiles(races['pages_fetched'].astype(np.float64))}")
+    print(f"  Speculative / race:    mean {races['speculated'].mean():.1f}")
+    print(f"  Race seconds:          {_percentiles(races['seconds'])}")
+
+    if len(steps['race_id']):
+        print(f"\n  Step latency (s), {len(steps['race_id'])} steps:")
+        for column in ('fetch_s', 'embed_s', 'rank_s', 'step_s'):
+            print(f"    {column[:-2]:<6} {_percentiles(steps[column])}")
+        print(f"  Candidates per step:   mean {steps['candidates'].mean():.0f}")
+        print(f"  Prefetch hit rate:     {steps['prefetch_hit'].mean():.1%}")
+        lookups = steps['cache_hits'].sum() + steps['cache_misses'].sum()
+        if lookups:
+            print(f"  Embeddings reused:     {steps['cache_hits'].sum() / lookups:.1%}")
+    print("="*60 + "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="WikiRacer run log tools")
+    commands = parser.add_subparsers(dest='command', required=True)
+    report_parser = commands.add_parser('report', help="Summarize recorded races")
+    report_parser.add_argument('directory', nargs='?', default=DEFAULT_LOG_DIR)
+    args = parser.parse_args()
+
+    if args.command == 'report':
+        report(args.directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+import multiprocessing
+import os
+import time
+
+import pytest
+
+from distributed import LeaseHeartbeat, SharedPageStore, SQLiteBroker
+from link_table import LinkTable, page_id, page_key
+
+URLS = [f"https://en.wikipedia.org/wiki/Page_{i}" for i in range(12)]
+
+
+def fake_fetch(url, scheduler=None, priority=None):
+    """Link source that logs every real fetch to WIKIRACER_TEST_FETCH_LOG."""
+    with open(os.environ['WIKIRACER_TEST_FETCH_LOG'], 'a') as f:
+        f.write(url + '\n')
+    time.sleep(0.05)
+
+    links = LinkTable()
+    name = url.rsplit('/', 1)[1]
+    key = page_key(f"/wiki/{name}_link")
+    links.append(f"{name} link", f"https://en.wikipedia.org/wiki/{name}_link", key, page_id(key), f"{name} link")
+    return {'source_page': name, 'total_links': 1, 'links': links}
+
+
+def visit_all(db_path, worker, log_path, results):
+    os.environ['WIKIRACER_TEST_FETCH_LOG'] = log_path
+    broker = SQLiteBroker(db_path)
+    store = SharedPageStore(broker, worker, fake_fetch, poll_interval=0.01)
+    try:
+        seen = {}
+        for url in URLS:
+            data = store(url)
+            seen[url] = (data['source_page'], data['links'].names)
+        results.put((worker, seen))
+    finally:
+        broker.close()
+
+
+def test_each_page_fetched_once_across_processes(tmp_path):
+    db_path = str(tmp_path / 'broker.sqlite')
+    log_path = str(tmp_path / 'fetches.log')
+    SQLiteBroker(db_path).close()
+
+    results = multiprocessing.Queue()
+    procs = [
+        multiprocessing.Process(target=visit_all, args=(db_path, f"worker-{i}", log_path, results))
+        for i in range(4)
+    ]
+    for proc in procs:
+        proc.start()
+    seen = [results.get(timeout=60) for _ in procs]
+    for proc in procs:
+        proc.join(timeout=60)
+        assert proc.exitcode == 0
+
+    with open(log_path) as f:
+        fetched = f.read().split()
+    assert sorted(fetched) == sorted(URLS)
+
+    expected = {url: (url.rsplit('/', 1)[1], [f"{url.rsplit('/', 1)[1]} link"]) for url in URLS}
+    for _, pages in seen:
+        assert pages == expected
+
+
+def test_heartbeat_keeps_lease_and_complete_checks_worker(tmp_path):
+    db_path = str(tmp_path / 'broker.sqlite')
+    owner = SQLiteBroker(db_path, lease_seconds=0.3)
+    other = SQLiteBroker(db_path, lease_seconds=0.3)
+    try:
+        task_id = owner.submit('race', {'start_url': 'a', 'end_url': 'b'})
+        assert owner.claim('owner')[0] == task_id
+
+        heartbeat = LeaseHeartbeat(db_path, 'owner', lease_seconds=0.3, interval=0.05).start()
+        time.sleep(0.8)
+        assert other.claim('other') is None
+        heartbeat.stop()
+
+        # Once renewals stop the lease expires and the task moves on
+        time.sleep(0.4)
+        assert other.claim('other')[0] == task_id
+        assert not owner.complete(task_id, 'owner', {'success': True})
+        assert other.complete(task_id, 'other', {'success': False})
+        assert owner.results([task_id]) == {task_id: ('done', {'success': False})}
+    finally:
+        owner.close()
+        other.close()
+
+
+def test_store_serves_prefetch_threads(tmp_path, monkeypatch):
+    from prefetch import Prefetcher
+
+    monkeypatch.setenv('WIKIRACER_TEST_FETCH_LOG', str(tmp_path / 'fetches.log'))
+    broken = URLS[1]
+
+    def fetch(url, scheduler=None, priority=None):
+        if url == broken:
+            raise ConnectionError("stand-in failure")
+        return fake_fetch(url, scheduler, priority)
+
+    broker = SQLiteBroker(str(tmp_path / 'broker.sqlite'))
+    store = SharedPageStore(broker, 'worker', fetch, poll_interval=0.01)
+    prefetcher = Prefetcher(store, depth=3)
+    try:
+        prefetcher.speculate(URLS[:3])
+        assert prefetcher.get(URLS[0])['source_page'] == 'Page_0'
+        # The failed speculation counts as a miss and the page is fetched again
+        with pytest.raises(ConnectionError):
+            prefetcher.get(broken)
+        assert prefetcher.stats['hits'] == 1
+        assert prefetcher.stats['misses'] == 1
+    finally:
+        prefetcher.close()
+        broker.close()
+
+    assert store.stats['fetches'] == 2
@@ -0,0 +1,112 @@
+import zlib
+
+import numpy as np
+import pytest
+
+pytest.importorskip('chromadb')
+pytest.importorskip('sentence_transformers')
+
+from embeddings import PageWorkspace  # noqa: E402
+from link_table import LinkTable, page_id, page_key  # noqa: E402
+from quantized import MemoryBudget, QuantizedMatrix  # noqa: E402
+
+DIM = 16
+
+
+class FakeEncoder:
+    """Deterministic per-name vectors that remembers every batch it was asked for."""
+
+    def __init__(self, dtype='float32'):
+        self.dtype = dtype
+        self.calls = []
+
+    def vectors(self, names):
+        return np.stack([np.random.default_rng(zlib.crc32(name.encode())).standard_normal(DIM)
+                         for name in names]).astype(np.float32)
+
+    def __call__(self, names):
+        self.calls.append(list(names))
+        return QuantizedMatrix.from_float(self.vectors(names), self.dtype)
+
+    def fresh(self, names):
+        return QuantizedMatrix.from_float(self.vectors(names), self.dtype).to_float()
+
+
+def table(names):
+    links = LinkTable()
+    for name in names:
+        key = page_key(f"/wiki/{name}")
+        links.append(name, f"https://en.wikipedia.org/wiki/{name}", key, page_id(key), name)
+    return links
+
+
+@pytest.mark.parametrize('dtype', ['float32', 'int8'])
+def test_revisions_reuse_rows_and_encode_only_added_names(dtype):
+    encode = FakeEncoder(dtype)
+    workspace = PageWorkspace(MemoryBudget())
+
+    # First visit: duplicate names are encoded once
+    page = table(['Alpha', 'Beta', 'Gamma', 'Beta'])
+    embeddings = workspace.embed('potato', 1, page, page, encode)
+    assert encode.calls == [['Alpha', 'Beta', 'Gamma']]
+    np.testing.assert_array_equal(embeddings.to_float(), encode.fresh(page.names))
+
+    # Same revision, same links, and a prefiltered subset: nothing is encoded
+    assert np.array_equal(workspace.embed('potato', 1, page, page, encode).to_float(), embeddings.to_float())
+    subset = page.take([2, 0])
+    np.testing.assert_array_equal(workspace.embed('potato', 1, page, subset, encode).to_float(),
+                                  encode.fresh(['Gamma', 'Alpha']))
+    assert len(encode.calls) == 1
+
+    # New revision: Beta was removed and Delta added; only Delta is encoded
+    revised = table(['Gamma', 'Delta', 'Alpha'])
+    np.testing.assert_array_equal(workspace.embed('potato', 2, revised, revised, encode).to_float(),
+                                  encode.fresh(revised.names))
+    assert encode.calls[1:] == [['Delta']]
+    assert set(workspace.pages['potato']['names']) == {'Gamma', 'Delta', 'Alpha'}
+
+    # A removed link that comes back is encoded again rather than resurrected
+    restored = table(['Alpha', 'Beta'])
+    workspace.embed('potato', 3, restored, restored, encode)
+    assert encode.calls[2:] == [['Beta']]
+
+    stats = workspace.stats
+    assert stats['misses'] == 1
+    assert stats['hits'] == 2
+    assert stats['partial'] == 2
+    assert stats['invalidations'] == 2
+    assert stats['encoded_rows'] == sum(len(call) for call in encode.calls)
+
+
+def test_unknown_revision_never_counts_as_same():
+    encode = FakeEncoder()
+    workspace = PageWorkspace(MemoryBudget())
+    page = table(['Alpha', 'Beta'])
+
+    workspace.embed('goat', None, page, page, encode)
+    workspace.embed('goat', None, page, page, encode)
+
+    # Rows still present on the page are kept, so nothing is re-encoded
+    assert encode.calls == [['Alpha', 'Beta']]
+    assert workspace.stats['invalidations'] == 1
+
+
+def test_least_recently_used_pages_are_evicted_under_budget():
+    encode = FakeEncoder()
+    probe = PageWorkspace(MemoryBudget())
+    names = [f"Link {i}" for i in range(20)]
+    probe.embed('probe', 1, table(names), table(names), encode)
+    page_bytes = probe.nbytes()
+
+    budget = MemoryBudget(3 * page_bytes)
+    workspace = PageWorkspace(budget)
+    for key in ('a', 'b', 'c'):
+        workspace.embed(key, 1, table(names), table(names), encode)
+        budget.enforce()
+    workspace.embed('a', 1, table(names), table(names), encode)
+    workspace.embed('d', 1, table(names), table(names), encode)
+    budget.enforce()
+
+    assert list(workspace.pages) == ['c', 'a', 'd']
+    assert budget.used() <= budget.limit_bytes
+    assert workspace.nbytes() == sum(entry['nbytes'] for entry in workspace.pages.values())
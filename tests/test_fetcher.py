@@ -0,0 +1,133 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from fetcher import FetchScheduler, PRIORITY_NORMAL, PRIORITY_PREFETCH, PRIORITY_TARGET
+
+
+class StandIn:
+    """Local HTTP server that replays scripted (status, headers) responses per path."""
+
+    def __init__(self, scripts):
+        self.scripts = {path: list(responses) for path, responses in scripts.items()}
+        self.log = []
+        self.lock = threading.Lock()
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with stand_in.lock:
+                    stand_in.log.append((self.path, time.time()))
+                    # The last scripted response repeats; unknown paths return 200
+                    script = stand_in.scripts.get(self.path, [])
+                    status, headers = script.pop(0) if len(script) > 1 else (script[0] if script else (200, {}))
+                self.send_response(status)
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.send_header('Content-Length', '2')
+                self.end_headers()
+                self.wfile.write(b'ok')
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.base = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def times(self, path):
+        return [t for p, t in self.log if p == path]
+
+    def order(self):
+        return [p for p, _ in self.log]
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def stand_in():
+    servers = []
+
+    def start(scripts):
+        server = StandIn(scripts)
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.close()
+
+
+def test_retries_429_then_503_then_succeeds(stand_in):
+    server = stand_in({'/page': [(429, {'Retry-After': '1'}), (503, {}), (200, {})]})
+    scheduler = FetchScheduler(backoff_base=0.05, backoff_max=5.0)
+    try:
+        response = scheduler.fetch(server.base + '/page', PRIORITY_TARGET)
+    finally:
+        scheduler.shutdown()
+
+    assert response.status_code == 200
+    times = server.times('/page')
+    assert len(times) == 3
+    assert times[1] - times[0] >= 0.9
+
+    metrics = scheduler.metrics()
+    assert metrics['requests'] == 3
+    assert metrics['retries'] == 2
+    assert metrics['throttled'] == 2
+    # The Retry-After block counts as queue wait for the request's lane
+    assert metrics['lanes']['target']['count'] == 1
+    assert metrics['lanes']['target']['max_wait'] >= 0.9
+
+
+def test_retry_after_is_capped_by_backoff_max(stand_in):
+    server = stand_in({'/page': [(429, {'Retry-After': '3600'}), (200, {})]})
+    scheduler = FetchScheduler(backoff_max=0.3)
+    start = time.time()
+    try:
+        assert scheduler.fetch(server.base + '/page').status_code == 200
+    finally:
+        scheduler.shutdown()
+    assert time.time() - start < 5
+
+
+def test_throttle_blocks_other_requests_to_host(stand_in):
+    server = stand_in({'/slow': [(429, {'Retry-After': '1'}), (200, {})], '/other': [(200, {})]})
+    scheduler = FetchScheduler(workers=1)
+    try:
+        first = scheduler.submit(server.base + '/slow')
+        time.sleep(0.2)
+        second = scheduler.submit(server.base + '/other')
+        assert first.result().status_code == 200
+        assert second.result().status_code == 200
+    finally:
+        scheduler.shutdown()
+
+    throttled_at = server.times('/slow')[0]
+    assert server.times('/other')[0] - throttled_at >= 0.9
+
+
+def test_target_lane_gets_next_token_while_rate_limited(stand_in):
+    server = stand_in({})
+    scheduler = FetchScheduler(rate=4.0, burst=1.0, workers=2)
+    try:
+        scheduler.fetch(server.base + '/warmup')
+        # The bucket is empty: all three wait for tokens, then run by lane
+        futures = [
+            scheduler.submit(server.base + '/prefetch', PRIORITY_PREFETCH),
+            scheduler.submit(server.base + '/normal', PRIORITY_NORMAL),
+            scheduler.submit(server.base + '/target', PRIORITY_TARGET),
+        ]
+        for future in futures:
+            assert future.result().status_code == 200
+    finally:
+        scheduler.shutdown()
+
+    assert server.order() == ['/warmup', '/target', '/normal', '/prefetch']
+    lanes = scheduler.metrics()['lanes']
+    assert lanes['prefetch']['max_wait'] > lanes['target']['max_wait']
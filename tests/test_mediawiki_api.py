@@ -0,0 +1,117 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from mediawiki_api import fetch_links_api, fetch_links_api_batch, fetch_links_batch
+
+# Two pages of a query for "potato|Spud|Goat|Nowhere": "potato" is normalized,
+# "Spud" redirects twice, and Potato's links are split by plcontinue
+FIRST = {
+    'continue': {'plcontinue': '101|0|Cooking', 'continue': '||'},
+    'query': {
+        'normalized': [{'fromencoded': False, 'from': 'potato', 'to': 'Potato'}],
+        'redirects': [{'from': 'Spud', 'to': 'Potatoes'}, {'from': 'Potatoes', 'to': 'Potato'}],
+        'pages': [
+            {'pageid': 101, 'ns': 0, 'title': 'Potato', 'lastrevid': 1111,
+             'links': [{'ns': 0, 'title': 'Andes'}, {'ns': 0, 'title': 'Crème fraîche'}]},
+            {'pageid': 102, 'ns': 0, 'title': 'Goat', 'lastrevid': 2222},
+            {'ns': 0, 'title': 'Nowhere', 'missing': True},
+        ],
+    },
+}
+SECOND = {
+    'batchcomplete': True,
+    'query': {
+        'pages': [
+            {'pageid': 101, 'ns': 0, 'title': 'Potato', 'lastrevid': 1111,
+             'links': [{'ns': 0, 'title': 'Cooking'}, {'ns': 0, 'title': 'Andes'}]},
+            {'pageid': 102, 'ns': 0, 'title': 'Goat', 'lastrevid': 2222,
+             'links': [{'ns': 0, 'title': 'Milk'}]},
+        ],
+    },
+}
+
+
+@pytest.fixture
+def api():
+    requests_seen = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            params = {k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()}
+            requests_seen.append(params)
+            body = json.dumps(SECOND if 'plcontinue' in params else FIRST).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/api.php", requests_seen
+    server.shutdown()
+    server.server_close()
+
+
+def test_batch_merges_continuation_and_resolves_titles(api):
+    api_url, requests_seen = api
+    pages = fetch_links_batch(['potato', 'Spud', 'Goat', 'Nowhere'], api_url,
+                              article_base='https://wiki.example')
+
+    assert len(requests_seen) == 2
+    assert requests_seen[0]['titles'] == 'potato|Spud|Goat|Nowhere'
+    assert requests_seen[1]['plcontinue'] == '101|0|Cooking'
+    assert 'Nowhere' not in pages
+
+    potato = pages['potato']
+    assert potato['canonical_title'] == 'Potato'
+    assert potato['redirects'] == []
+    assert potato['revision_id'] == 1111
+    assert potato['links'].names == ['Andes', 'Crème fraîche', 'Cooking']
+    assert potato['links'].urls == [
+        'https://wiki.example/wiki/Andes',
+        'https://wiki.example/wiki/Cr%C3%A8me_fra%C3%AEche',
+        'https://wiki.example/wiki/Cooking',
+    ]
+    assert potato['source_url'] == 'https://wiki.example/wiki/Potato'
+
+    spud = pages['Spud']
+    assert spud['canonical_title'] == 'Potato'
+    assert spud['redirects'] == [{'from': 'Spud', 'to': 'Potatoes'}, {'from': 'Potatoes', 'to': 'Potato'}]
+    assert spud['links'].names == potato['links'].names
+
+    goat = pages['Goat']
+    assert goat['revision_id'] == 2222
+    assert goat['links'].names == ['Milk']
+
+
+def test_drop_in_reads_api_url_at_call_time(api, monkeypatch):
+    api_url, requests_seen = api
+    monkeypatch.setenv('WIKIRACER_API_URL', api_url)
+
+    data = fetch_links_api('https://en.wikipedia.org/wiki/Goat')
+
+    assert len(requests_seen) == 2
+    assert data['source_url'] == 'https://en.wikipedia.org/wiki/Goat'
+    assert data['links'].urls == ['https://en.wikipedia.org/wiki/Milk']
+    assert data['total_links'] == 1
+
+
+def test_url_batch_keys_results_by_url(api):
+    api_url, _ = api
+    urls = ['https://en.wikipedia.org/wiki/Spud', 'https://en.wikipedia.org/wiki/Goat',
+            'https://en.wikipedia.org/wiki/Nowhere']
+
+    pages = fetch_links_api_batch(urls, api_url=api_url)
+
+    assert set(pages) == set(urls[:2])
+    assert pages[urls[0]]['canonical_title'] == 'Potato'
+    assert pages[urls[0]]['source_url'] == urls[0]
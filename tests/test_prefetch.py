@@ -0,0 +1,87 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from fetcher import FetchScheduler
+from prefetch import Prefetcher
+
+
+@pytest.fixture
+def slow_server():
+    """Stand-in wiki whose pages each take 0.3 s to serve."""
+    served = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            served.append(self.path)
+            time.sleep(0.3)
+            self.send_response(200)
+            self.send_header('Content-Length', '4')
+            self.end_headers()
+            self.wfile.write(b'page')
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}", served
+    server.shutdown()
+    server.server_close()
+
+
+def link_source(url, scheduler=None, priority=None):
+    response = scheduler.fetch(url, priority)
+    return {'source_url': url, 'bytes': len(response.content)}
+
+
+@pytest.fixture
+def scheduler():
+    # One worker: the first speculation is on the wire, the rest wait in the queue
+    scheduler = FetchScheduler(workers=1)
+    yield scheduler
+    scheduler.shutdown()
+
+
+def test_choosing_a_page_cancels_queued_speculation(slow_server, scheduler):
+    base, served = slow_server
+    urls = [f"{base}/wiki/Page_{i}" for i in range(3)]
+    prefetcher = Prefetcher(link_source, scheduler, depth=3)
+    try:
+        prefetcher.speculate(urls)
+        time.sleep(0.1)
+
+        data = prefetcher.get(urls[0])
+        assert data['source_url'] == urls[0]
+        assert not prefetcher.pending
+    finally:
+        prefetcher.close()
+
+    assert served == ['/wiki/Page_0']
+    assert prefetcher.stats['hits'] == 1
+    assert prefetcher.stats['cancelled'] == 2
+    assert prefetcher.stats['wasted'] == 0
+
+
+def test_respeculating_drops_stale_requests(slow_server, scheduler):
+    base, served = slow_server
+    old = [f"{base}/wiki/Old_{i}" for i in range(3)]
+    new = [f"{base}/wiki/New_{i}" for i in range(2)]
+    prefetcher = Prefetcher(link_source, scheduler, depth=3)
+    try:
+        prefetcher.speculate(old)
+        time.sleep(0.1)
+        prefetcher.speculate(new)
+
+        assert prefetcher.get(new[1])['source_url'] == new[1]
+    finally:
+        prefetcher.close()
+
+    # Old_0 was already on the wire; the other stale pages never left the queue
+    assert '/wiki/Old_1' not in served
+    assert '/wiki/Old_2' not in served
+    assert prefetcher.stats['wasted'] == 1
+    assert prefetcher.stats['cancelled'] == 3
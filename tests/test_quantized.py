@@ -0,0 +1,105 @@
+import numpy as np
+import pytest
+
+from quantized import EmbeddingCache, MemoryBudget, QuantizedMatrix
+
+
+def unit_rows(rows, dim, seed=0):
+    matrix = np.random.default_rng(seed).standard_normal((rows, dim)).astype(np.float32)
+    return matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+
+
+@pytest.mark.parametrize('dtype, tolerance', [('float16', 2e-3), ('int8', 2e-2)])
+def test_scores_match_float32(dtype, tolerance, monkeypatch):
+    # Small blocks so the blockwise upcast path covers several blocks
+    monkeypatch.setattr('quantized.SCORE_BLOCK_ROWS', 64)
+    matrix = unit_rows(300, 48)
+    queries = unit_rows(3, 48, seed=1)
+
+    expected = QuantizedMatrix.from_float(matrix).scores(queries)
+    scores = QuantizedMatrix.from_float(matrix, dtype).scores(queries)
+
+    assert scores.shape == (300, 3)
+    assert scores.dtype == np.float32
+    np.testing.assert_allclose(scores, expected, atol=tolerance)
+
+
+def test_int8_keeps_per_row_scales():
+    matrix = unit_rows(10, 16) * np.arange(1, 11, dtype=np.float32)[:, None]
+    quantized = QuantizedMatrix.from_float(matrix, 'int8')
+
+    assert quantized.data.dtype == np.int8
+    np.testing.assert_allclose(quantized.to_float(), matrix, atol=np.abs(matrix).max() / 127)
+    np.testing.assert_allclose(quantized[[2, 7]].to_float(), quantized.to_float()[[2, 7]])
+
+
+@pytest.mark.parametrize('dtype', ['float32', 'int8'])
+def test_cache_returns_right_vectors_after_shrink_and_compact(dtype):
+    budget = MemoryBudget()
+    cache = EmbeddingCache('names', 16, dtype, budget, initial_rows=8)
+    vectors = unit_rows(100, 16)
+    keys = [f"name {i}" for i in range(100)]
+    cache.put(keys, QuantizedMatrix.from_float(vectors, dtype))
+    assert len(cache.slab) >= 100
+
+    # Touch a few old keys so they survive eviction
+    cache.lookup(keys[:5])
+    freed = cache.shrink(cache.nbytes() // 2)
+
+    assert freed > 0
+    assert len(cache.slab) < 100
+    assert len(cache.slab) == len(cache.slots) + len(cache.slots) // 8
+    assert all(key in cache.slots for key in keys[:5])
+    assert keys[5] not in cache.slots
+
+    live = list(cache.slots)
+    expected = QuantizedMatrix.from_float(vectors[[keys.index(key) for key in live]], dtype).to_float()
+    np.testing.assert_array_equal(cache.gather(cache.lookup(live)).to_float(), expected)
+
+    # Growing again after compaction keeps the survivors intact
+    more = unit_rows(50, 16, seed=2)
+    cache.put([f"more {i}" for i in range(50)], QuantizedMatrix.from_float(more, dtype))
+    np.testing.assert_array_equal(cache.gather(cache.lookup(live)).to_float(), expected)
+    np.testing.assert_array_equal(
+        cache.gather(cache.lookup([f"more {i}" for i in range(50)])).to_float(),
+        QuantizedMatrix.from_float(more, dtype).to_float()
+    )
+
+
+def test_budget_holds_across_many_inserts():
+    budget = MemoryBudget(200_000)
+    cache = EmbeddingCache('names', 32, 'float16', budget, initial_rows=64)
+
+    class Pages:
+        """Second consumer evicted whole entries at a time, like the page workspace."""
+
+        def __init__(self):
+            self.entries = []
+            budget.register(self)
+
+        def nbytes(self):
+            return sum(self.entries)
+
+        def shrink(self, nbytes):
+            freed = 0
+            while self.entries and freed < nbytes:
+                freed += self.entries.pop(0)
+            return freed
+
+        def report(self):
+            return {'name': 'pages', 'bytes': self.nbytes()}
+
+    pages = Pages()
+    for batch in range(200):
+        keys = [f"{batch}-{i}" for i in range(37)]
+        cache.put(keys, QuantizedMatrix.from_float(unit_rows(37, 32, seed=batch), 'float16'))
+        pages.entries.append(3000)
+        budget.enforce()
+        assert budget.used() <= budget.limit_bytes
+
+        # The newest batch is always still cached
+        assert (cache.lookup(keys) >= 0).all()
+
+    report = budget.report()
+    assert report['used_bytes'] <= 200_000
+    assert report['caches'][0]['bytes'] == cache.slab.nbytes + cache.key_bytes
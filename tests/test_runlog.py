@@ -0,0 +1,67 @@
+import glob
+import os
+
+import numpy as np
+
+from runlog import RunLog, load, report
+
+
+def race_row(i):
+    return {
+        'race_id': f"race-{i}", 'start_url': f"https://en.wikipedia.org/wiki/Start_{i}",
+        'end_url': 'https://en.wikipedia.org/wiki/Goal', 'outcome': 'reached_target' if i % 2 else 'max_depth',
+        'success': bool(i % 2), 'steps': i + 1, 'pages_fetched': i + 2, 'speculated': i,
+        'started': 1_700_000_000.0 + i, 'seconds': 0.5 * i,
+    }
+
+
+def step_row(i):
+    return {
+        'race_id': f"race-{i // 2}", 'step': i, 'url': f"https://en.wikipedia.org/wiki/Page_{i}",
+        'chosen_name': f"Link {i}", 'chosen_url': f"https://en.wikipedia.org/wiki/Link_{i}",
+        # The final step of a failed fetch has no chosen link and no distance
+        'distance': None if i % 3 == 0 else 0.1 * i, 'links': 100 + i, 'candidates': 10 + i,
+        'found_target': i == 6, 'fetch_s': 0.01 * i, 'embed_s': 0.02 * i, 'rank_s': 0.001 * i,
+        'step_s': 0.05 * i, 'prefetch_hit': i % 2 == 0, 'cache_hits': i, 'cache_misses': 7 - i,
+    }
+
+
+def test_round_trip_across_batches(tmp_path, capsys):
+    directory = str(tmp_path / 'runs')
+    log = RunLog(directory, batch_size=3)
+    for i in range(4):
+        log.add_race(**race_row(i))
+    for i in range(7):
+        log.add_step(**step_row(i))
+
+    # Full batches are written as they fill; the rest waits for flush()
+    assert len(glob.glob(os.path.join(directory, 'races-*.npz'))) == 1
+    assert len(glob.glob(os.path.join(directory, 'steps-*.npz'))) == 2
+    log.flush()
+    assert len(glob.glob(os.path.join(directory, 'races-*.npz'))) == 2
+    assert len(glob.glob(os.path.join(directory, 'steps-*.npz'))) == 3
+
+    races = load(directory, 'races')
+    assert list(races['race_id']) == [f"race-{i}" for i in range(4)]
+    assert list(races['success']) == [False, True, False, True]
+    assert races['steps'].dtype == np.int32
+    np.testing.assert_array_equal(races['steps'], [1, 2, 3, 4])
+
+    steps = load(directory, 'steps')
+    assert list(steps['step']) == list(range(7))
+    assert list(steps['chosen_name']) == [f"Link {i}" for i in range(7)]
+    distance = steps['distance']
+    assert np.isnan(distance[[0, 3, 6]]).all()
+    np.testing.assert_allclose(distance[[1, 2, 4, 5]], [0.1, 0.2, 0.4, 0.5], rtol=1e-6)
+    assert list(steps['found_target']) == [i == 6 for i in range(7)]
+
+    report(directory)
+    out = capsys.readouterr().out
+    assert "Races: 4" in out
+    assert "Success rate: 50.0%" in out
+    assert "Step latency (s), 7 steps" in out
+
+
+def test_report_without_races(tmp_path, capsys):
+    report(str(tmp_path))
+    assert "No races recorded." in capsys.readouterr().out